@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Benchmark the decoders of raw tweet lines in tweet_decoder.py, in tweets per second.
+Each backend decodes the same lines held in memory, then reads the fields TweetExtractor reads,
+so that lazily materialized values are paid for as well.
+
+Usage: python benchmark_decoder.py
+Input data files: ../data/[app_name]/[app_name]_all/*.bz2 (or any other codec in utils/codec.py), the first hourly file
+Time: ~1M
+"""
+
+import sys, os, time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
+from utils.codec import codec_open, split_codec_path
+from analysis.tweet_decoder import get_decoder, decoder_backends
+
+
+def read_fields(tweet_json):
+    """Touch the fields read by TweetExtractor."""
+    if 'limit' in tweet_json:
+        return tweet_json['limit']['timestamp_ms'], tweet_json['limit']['track']
+    if 'id_str' not in tweet_json:
+        return None
+    values = [tweet_json['id_str'], tweet_json['created_at'], tweet_json['timestamp_ms'], tweet_json.get('lang'),
+              tweet_json['in_reply_to_status_id_str'], tweet_json['in_reply_to_user_id_str']]
+    for field in [None, 'retweeted_status', 'quoted_status']:
+        status = tweet_json if field is None else tweet_json.get(field)
+        if status is None:
+            continue
+        user = status['user']
+        values.extend([status['id_str'], status['place'], status['filter_level'], status['retweet_count'], status['favorite_count'],
+                       user['id_str'], user['followers_count'], user['friends_count'], user['statuses_count'], user['favourites_count'],
+                       status['extended_tweet'].get('full_text') if 'extended_tweet' in status else status['text']])
+        values.extend(url['expanded_url'] for url in status['entities']['urls'])
+        values.extend(hashtag['text'] for hashtag in status['entities']['hashtags'])
+        values.extend(user_mention['id_str'] for user_mention in status['entities']['user_mentions'])
+    return values
+
+
+def main():
+    app_name = 'covid'
+    input_dir = '../data/{0}/{0}_all'.format(app_name)
+    # number of lines decoded by each backend, and number of repeats where the best one is reported
+    num_line = 100000
+    num_repeat = 3
+
+    input_file = sorted(f for f in os.listdir(input_dir) if split_codec_path(f)[1] is not None)[0]
+    lines = []
+    with codec_open(os.path.join(input_dir, input_file), 'rb') as fin:
+        for line in fin:
+            if line.rstrip():
+                lines.append(line)
+            if len(lines) >= num_line:
+                break
+    print('>>> Decoding {0} lines of {1}'.format(len(lines), os.path.join(input_dir, input_file)))
+
+    for backend in decoder_backends:
+        try:
+            decode = get_decoder(backend)
+        except ImportError as e:
+            print('>>> {0: <10}: skipped, {1}'.format(backend, e))
+            continue
+        best_time = None
+        for _ in range(num_repeat):
+            start_time = time.perf_counter()
+            for line in lines:
+                read_fields(decode(line))
+            elapsed_time = time.perf_counter() - start_time
+            if best_time is None or elapsed_time < best_time:
+                best_time = elapsed_time
+        print('>>> {0: <10}: {1: >9.0f} tweets/sec'.format(backend, len(lines) / best_time))
+
+
+if __name__ == '__main__':
+    main()
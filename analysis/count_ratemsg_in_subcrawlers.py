@@ -8,41 +8,38 @@ Input data files: ../data/[app_name]_out/[app_name]_*/ts_[app_name]_*.bz2, ../da
 Time: ~20M
 """
 
-import sys, os, bz2
+import sys, os
+import numpy as np
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
-from utils.helper import Timer, count_track
+from utils.helper import Timer, list_suffixes
+from utils.codec import codec_open, find_codec_file
+from utils.binning import load_ts_columns, count_track_array
 
 
 def main():
     app_name = 'covid'
-    if app_name == 'cyberbullying':
-        target_suffix = ['1', '2', '3', '4', '5', '6', '7', '8', 'all']
-    elif app_name == 'youtube' or app_name == 'covid':
-        target_suffix = ['1', '2', '3', '4', '5', '6', '7', '8', '9', '10', '11', '12', 'all']
-    else:
-        target_suffix = ['1', '2', '3', '4', '5', '6', '7', '8', 'all']
-
     archive_dir = '../data/{0}_out'.format(app_name)
+    target_suffix = list_suffixes(archive_dir, app_name)
 
     timer = Timer()
     timer.start()
 
-    est_num_tweet = 0
+    num_tweets = []
+    all_tracks = []
+    all_groups = []
+    for i, suffix in enumerate(target_suffix):
+        tweet_ts, _, _, tracks = load_ts_columns(find_codec_file(os.path.join(archive_dir, '{0}_{1}/ts_{0}_{1}'.format(app_name, suffix))))
+        num_tweets.append(len(tweet_ts))
+        all_tracks.append(tracks)
+        all_groups.append(np.full(len(tracks), i, dtype=np.int64))
+    # missing tweets of all subcrawlers in one pass
+    num_misses = count_track_array(np.concatenate(all_tracks), groups=np.concatenate(all_groups), num_group=len(target_suffix))[:, 0]
 
-    for suffix in target_suffix:
-        num_tweet = 0
-        num_ratemsg = 0
-        track_list = []
-        with bz2.BZ2File(os.path.join(archive_dir, '{0}_{1}/ts_{0}_{1}.bz2'.format(app_name, suffix)), mode='r') as fin:
-            for line in fin:
-                line = line.decode('utf-8')
-                if 'ratemsg' in line:
-                    num_ratemsg += 1
-                    track_list.append(int(line.rstrip().split(',')[2]))
-                else:
-                    num_tweet += 1
-        num_miss = count_track(track_list)
+    est_num_tweet = 0
+    for suffix, num_tweet, tracks, num_miss in zip(target_suffix, num_tweets, all_tracks, num_misses):
+        num_ratemsg = len(tracks)
+        num_miss = int(num_miss)
         subcrawler_sampling_rate = num_tweet / (num_tweet + num_miss)
         print('>>> subcrawler {0}_{1: <3}, {2: >9d} retrieved tweets, {3: >7d} rate limit track, indicating {4: >9d} missing tweets, yielding {5: >6.2f}% sampling rate'
               .format(app_name, suffix, num_tweet, num_ratemsg, num_miss, 100 * subcrawler_sampling_rate))
@@ -50,7 +47,7 @@ def main():
             est_num_tweet = num_tweet + num_miss
 
     gt_num_tweet = 0
-    with bz2.BZ2File(os.path.join(archive_dir, 'complete_ts_{0}.bz2'.format(app_name)), mode='r') as fin:
+    with codec_open(find_codec_file(os.path.join(archive_dir, 'complete_ts_{0}'.format(app_name))), 'rb') as fin:
         for _ in fin:
             gt_num_tweet += 1
     gt_sampling_rate = gt_num_tweet / est_num_tweet
@@ -24,8 +24,10 @@
 2. ratemsg, timestamp_ms, track
 
 Usage: python extract_tweet_status.py
-Input data files: ../data/[app_name]/[app_name]_*/*.bz2
-Output data files: ../data/[app_name]_out/[app_name]_*/tweet_stats/*.bz2, ../data/[app_name]_out/[app_name]_*/timestamp/*.txt
+Input data files: ../data/[app_name]/[app_name]_*/*.bz2 (or any other codec in utils/codec.py)
+Output data files: ../data/[app_name]_out/[app_name]_*/tweet_stats/*.bz2 (codec set in conf/[app_name]_crawler.conf, or *.parquet), ../data/[app_name]_out/[app_name]_*/timestamp/*.txt
+                   (or ../data/[app_name]_out/[app_name]_*/ts_runs/*.txt in fused mode)
+                   ../data/[app_name]_out/manifest.json, reruns only extract new or changed input files
 Time: ~20M
 """
 
@@ -33,14 +35,22 @@ import sys, os
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
 from utils.helper import Timer
+from utils.codec import load_codec_conf
 from analysis.tweet_extractor import TweetExtractor
 
 
-def extract_status(input_dir, output_dir, proc_num):
+def extract_status(input_dir, output_dir, proc_num, bz2_threads=1, codec='bz2', output_format='text', fused=False, decoder='auto', follow=False):
     """Extract tweet status from given folder, output in output_dir."""
     extractor = TweetExtractor(input_dir, output_dir)
     extractor.set_proc_num(proc_num)
+    extractor.set_bz2_threads(bz2_threads)
+    extractor.set_codec(codec)
+    extractor.set_output_format(output_format)
+    extractor.set_fused(fused)
+    extractor.set_decoder(decoder)
     extractor.extract()
+    if follow:
+        extractor.follow()
 
 
 if __name__ == '__main__':
@@ -52,7 +62,19 @@ if __name__ == '__main__':
     input_dir = '../data/{0}'.format(app_name)
     output_dir = '../data/{0}_out'.format(app_name)
 
+    # many files, one core each: proc_num=24, bz2_threads=1
+    # one big file, many cores: proc_num=1, bz2_threads=24
     proc_num = 24
-    extract_status(input_dir, output_dir, proc_num)
+    bz2_threads = 1
+    codec = load_codec_conf('../conf/{0}_crawler.conf'.format(app_name))['extract']
+    # 'text' for comma-joined lines, 'parquet' for typed columns (requires pyarrow)
+    output_format = 'text'
+    # write sorted id/timestamp runs into ts_runs folder, then set fused = True in merge_subcrawlers.py
+    fused = False
+    # 'auto' picks orjson or msgspec if installed, 'projection' only decodes the extracted fields (requires msgspec)
+    decoder = 'auto'
+    # keep tailing the hours being crawled after extracting, set flush_interval in multi_process_crawlers.py for low latency
+    follow = False
+    extract_status(input_dir, output_dir, proc_num, bz2_threads, codec, output_format, fused, decoder, follow)
 
     timer.stop()
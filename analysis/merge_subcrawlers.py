@@ -8,42 +8,106 @@ assuming all missing tweets in each sub-crawler are disjointed, representing a u
 
 Usage: python merge_subcrawlers.py
 Input data files: ../data/[app_name]_out/[app_name]_*/timestamp/*.txt
+                  or ../data/[app_name]_out/[app_name]_*/ts_runs/*.txt if the extractor ran in fused mode
 Output data files: ../data/[app_name]_out/[app_name]_*/ts_[app_name]_*.bz2, ../data/[app_name]_out/complete_ts_[app_name]_*.bz2
+                   (codec set in conf/[app_name]_crawler.conf)
 Time: ~1H
 """
 
-import sys, os, bz2
+import sys, os
+import numpy as np
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
-from utils.helper import Timer, melt_snowflake, make_snowflake
-
-
-def find_next_item(nextline_list):
-    end_flag = all(v.rstrip() == '' for v in nextline_list)
-    if end_flag:
-        return None, None, True
-    else:
-        lst = []
-        for item in nextline_list:
-            if item.rstrip() == '':
-                lst.append('END')
-            else:
-                lst.append(item)
-        index_min = min(range(len(lst)), key=lst.__getitem__)
-        return index_min, lst[index_min], False
+from utils.helper import Timer, list_suffixes, make_snowflake, make_snowflake_array, snowflake_timestamp, make_ts_record, is_ratemsg_line, kway_merge, ratemsg_offset
+from utils.external_sort import ExternalSorter
+from utils.dedup import TweetIdSet
+from utils.codec import codec_open, codec_path, find_codec_file, load_codec_conf
+
+
+def read_timestamp_files(timestamp_dir, suffix, suffix_idx):
+    """Yield (snowflake_id, ts line) from the hourly timestamp files of a subcrawler, in collecting order.
+    Rate limit messages are placed in the id order by a snowflake id made from their shifted timestamp."""
+    for subdir, _, files in os.walk(timestamp_dir):
+        for f in sorted(files):
+            # skip temporary files of an extraction in progress
+            if not f.endswith('.txt'):
+                continue
+            with open(os.path.join(subdir, f), 'r') as fin:
+                for line in fin:
+                    yield make_ts_record(line.rstrip().split(','), suffix, suffix_idx)
+
+
+def load_timestamp_records(timestamp_dir, suffix, suffix_idx):
+    """Yield (snowflake_id, ts line) from the hourly timestamp files of a subcrawler, sorted by id,
+    keeping the first seen tweet and the last seen rate limit message of each id.
+    The same records as make_ts_record(), with the ids of rate limit messages made over whole columns."""
+    tweet_lines = []
+    tweet_ids = []
+    ratemsg_ts = []
+    ratemsg_tracks = []
+    for subdir, _, files in os.walk(timestamp_dir):
+        for f in sorted(files):
+            # skip temporary files of an extraction in progress
+            if not f.endswith('.txt'):
+                continue
+            with open(os.path.join(subdir, f), 'r') as fin:
+                for line in fin:
+                    split_line = line.rstrip().split(',')
+                    if len(split_line) == 3:
+                        ratemsg_ts.append(split_line[0])
+                        ratemsg_tracks.append(split_line[2])
+                    else:
+                        tweet_lines.append('{0},{1}'.format(split_line[0], split_line[1]))
+                        tweet_ids.append(split_line[1])
+    ratemsg_ids = make_snowflake_array(np.array(ratemsg_ts, dtype=str).astype(np.int64) - ratemsg_offset, 31, 31, suffix_idx)
+    ratemsg_ts = snowflake_timestamp(ratemsg_ids)
+    # the first occurrence of each id wins, rate limit messages are reversed in front so that the last seen one wins
+    num_ratemsg = len(ratemsg_ids)
+    all_ids = np.concatenate([ratemsg_ids[::-1], np.array(tweet_ids, dtype=str).astype(np.uint64)])
+    sorted_ids, first_idx = np.unique(all_ids, return_index=True)
+    for tid, idx in zip(sorted_ids.tolist(), first_idx.tolist()):
+        if idx < num_ratemsg:
+            ratemsg_idx = num_ratemsg - 1 - idx
+            yield tid, '{0},ratemsg{1},{2}'.format(ratemsg_ts[ratemsg_idx], suffix, ratemsg_tracks[ratemsg_idx])
+        else:
+            yield tid, tweet_lines[idx - num_ratemsg]
+
+
+def read_ts_file(inputfile, suffix_idx, verify_sorted=False):
+    """Yield (snowflake_id, line) from a sorted ts_* file opened in binary mode.
+    Rate limit messages are keyed by the snowflake id that placed them in the per-subcrawler order.
+    If verify_sorted, raise ValueError when the ids are not in ascending order."""
+    last_tid = -1
+    for line in inputfile:
+        line = line.decode('utf-8')
+        if line.rstrip() == '':
+            return
+        split_line = line.rstrip().split(',')
+        if len(split_line) == 3:
+            tid = make_snowflake(split_line[0], 31, 31, suffix_idx)
+        else:
+            tid = int(split_line[1])
+        if verify_sorted:
+            if tid < last_tid:
+                raise ValueError('Unsorted ts file of suffix index {0}: {1} comes after {2}'.format(suffix_idx, tid, last_tid))
+            last_tid = tid
+        yield tid, line
 
 
 def main():
     app_name = 'covid'
-    if app_name == 'cyberbullying':
-        target_suffix = ['1', '2', '3', '4', '5', '6', '7', '8', 'all']
-    elif app_name == 'youtube' or app_name == 'covid':
-        target_suffix = ['1', '2', '3', '4', '5', '6', '7', '8', '9', '10', '11', '12', 'all']
-    else:
-        target_suffix = ['1', '2', '3', '4', '5', '6', '7', '8', 'all']
-
     archive_dir = '../data/{0}_out'.format(app_name)
-    best_offset = 5000
+    target_suffix = list_suffixes(archive_dir, app_name)
+    codec = load_codec_conf('../conf/{0}_crawler.conf'.format(app_name))['merge']
+    # sort each subcrawler in spilled runs on disk, bounding memory to mem_budget MB
+    external_sort = False
+    mem_budget = 1024
+    # ts files are sorted by id, so duplicated tweets arrive consecutively in the complete stream merge,
+    # comparing against the last written id then needs O(1) memory instead of a set of all ids
+    streaming_dedup = True
+    verify_sorted = False
+    # the extractor ran in fused mode and wrote sorted runs, which only need to be k-way merged
+    fused = False
 
     # merge timestamps
     timer = Timer()
@@ -51,47 +115,47 @@ def main():
 
     for suffix_idx, suffix in enumerate(target_suffix):
         print('>>> Merging suffix {0}_{1}...'.format(app_name, suffix))
-        visited_tid = set()
-        ts_streaming_dict = {}
-        for subdir, _, files in os.walk(os.path.join(archive_dir, '{0}_{1}'.format(app_name, suffix), 'timestamp')):
-            for f in sorted(files):
-                with open(os.path.join(subdir, f), 'r') as fin:
-                    for line in fin:
-                        split_line = line.rstrip().split(',')
-                        if len(split_line) == 3:
-                            ts_streaming_dict[str(make_snowflake(int(split_line[0]) - best_offset, 31, 31, suffix_idx))] = 'ratemsg{0},{1}'.format(suffix, split_line[2])
-                        else:
-                            tweet_id = split_line[1]
-                            if tweet_id not in visited_tid:
-                                ts_streaming_dict[tweet_id] = split_line[0]
-                                visited_tid.add(tweet_id)
-
-        with bz2.open(os.path.join(archive_dir, '{0}_{1}/ts_{0}_{1}.bz2'.format(app_name, suffix)), 'wt') as ts_output:
-            for tid in sorted(ts_streaming_dict.keys()):
-                if ts_streaming_dict[tid].startswith('ratemsg'):
-                    ts = melt_snowflake(tid)[0]
-                    ts_output.write('{0},{1}\n'.format(ts, ts_streaming_dict[tid]))
-                else:
-                    ts_output.write('{0},{1}\n'.format(ts_streaming_dict[tid], tid))
+        suffix_dir = os.path.join(archive_dir, '{0}_{1}'.format(app_name, suffix))
+        if fused:
+            sorter = ExternalSorter(os.path.join(suffix_dir, 'sort_runs'), mem_budget=mem_budget, keep_last=is_ratemsg_line)
+            run_dir = os.path.join(suffix_dir, 'ts_runs')
+            sorter.add_runs([os.path.join(run_dir, f) for f in sorted(os.listdir(run_dir)) if f.endswith('.txt')])
+            sorted_records = sorter.sorted_unique()
+        elif external_sort:
+            ts_records = read_timestamp_files(os.path.join(suffix_dir, 'timestamp'), suffix, suffix_idx)
+            sorter = ExternalSorter(os.path.join(suffix_dir, 'sort_runs'), mem_budget=mem_budget, keep_last=is_ratemsg_line)
+            for tid, ts_line in ts_records:
+                sorter.add(tid, ts_line)
+            sorted_records = sorter.sorted_unique()
+        else:
+            sorted_records = load_timestamp_records(os.path.join(suffix_dir, 'timestamp'), suffix, suffix_idx)
+
+        with codec_open(codec_path(os.path.join(suffix_dir, 'ts_{0}_{1}'.format(app_name, suffix)), codec), 'wt') as ts_output:
+            for _, ts_line in sorted_records:
+                ts_output.write('{0}\n'.format(ts_line))
         print('>>> Finishing merging suffix {0}_{1}'.format(app_name, suffix))
 
     print('>>> Merging complete stream for {0}...'.format(app_name))
-    inputfile_list = ['{0}_{1}/ts_{0}_{1}.bz2'.format(app_name, suffix) for suffix in target_suffix]
-    inputfile_handles = [bz2.BZ2File(os.path.join(archive_dir, inputfile), mode='r') for inputfile in inputfile_list]
-    visited_item_set = set()
-
-    with bz2.open(os.path.join(archive_dir, 'complete_ts_{0}.bz2'.format(app_name)), 'wt') as ts_output:
-        nextline_list = [inputfile.readline().decode('utf-8') for inputfile in inputfile_handles]
-
-        while True:
-            next_idx, next_item, end_flag = find_next_item(nextline_list)
-            if end_flag:
-                break
+    inputfile_list = [find_codec_file(os.path.join(archive_dir, '{0}_{1}/ts_{0}_{1}'.format(app_name, suffix))) for suffix in target_suffix]
+    inputfile_handles = [codec_open(inputfile, 'rb') for inputfile in inputfile_list]
+    visited_tid = None if streaming_dedup else TweetIdSet()
+    last_tid = None
+
+    with codec_open(codec_path(os.path.join(archive_dir, 'complete_ts_{0}'.format(app_name)), codec), 'wt') as ts_output:
+        ts_streams = [read_ts_file(inputfile, suffix_idx, verify_sorted=verify_sorted) for suffix_idx, inputfile in enumerate(inputfile_handles)]
+        for tid, _, next_item in kway_merge(ts_streams):
             # omit rate limit messages in the all crawler
-            if 'ratemsg' not in next_item and next_item not in visited_item_set:
-                ts_output.write(next_item)
-                visited_item_set.add(next_item)
-            nextline_list[next_idx] = inputfile_handles[next_idx].readline().decode('utf-8')
+            if 'ratemsg' in next_item:
+                continue
+            if streaming_dedup:
+                if tid == last_tid:
+                    continue
+                last_tid = tid
+            else:
+                if tid in visited_tid:
+                    continue
+                visited_tid.add(tid)
+            ts_output.write(next_item)
 
     for inputfile in inputfile_handles:
         inputfile.close()
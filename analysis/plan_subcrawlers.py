@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Plan the keyword and language splits of the subcrawlers from the recent history of their extracted tweets.
+The volume of every (set of matched keywords, language) pattern is estimated per hour, corrected by the sampling rate of the subcrawler
+that observed it, i.e. collected tweets / (collected tweets + missing tweets indicated by rate limit messages).
+Each tweet counts once in its pattern, so the volume of a subcrawler counts a tweet matching several of its keywords once.
+The pairs are then packed into as few subcrawlers as possible that each stay under the rate limit, see utils/partition.py.
+
+Usage: python plan_subcrawlers.py
+Input data files: ../conf/[app_name]_crawler.conf, ../data/[app_name]_out/[app_name]_*/tweet_stats/*.bz2 (text format, any codec)
+Output data files: ../conf/[app_name]_crawler.planned.conf
+"""
+
+import sys, os, re, json
+from collections import Counter
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
+from utils.helper import Timer
+from utils.codec import codec_open, split_codec_path
+from utils.partition import plan_partition
+from analysis.tweet_writer import tweet_fields
+
+lang_idx = tweet_fields.index('original_lang')
+matched_idx = [tweet_fields.index(field) for field in ['original_hashtags', 'retweeted_hashtags', 'quoted_hashtags',
+                                                       'original_text', 'retweeted_text', 'quoted_text']]
+
+
+# the filter endpoint matches whole words, split on punctuation, so #covid matches covid but masked does not match mask
+word_pattern = re.compile(r'\W+')
+# languages that are not a language of the filter endpoint
+undetermined_languages = {'N', 'und'}
+
+
+def tokenize(text):
+    """Return the set of lowercased words of a text, split on non-word characters, which keeps the body of hashtags."""
+    return set(word_pattern.split(text.lower())) - {''}
+
+
+def match_keywords(words, keyword_terms):
+    """Return the keywords whose terms all occur as words of the text, as the filter endpoint matches phrases.
+    :param words: set of words of the text, see tokenize()
+    :param keyword_terms: list of (keyword, set of the words of its terms)"""
+    return [keyword for keyword, terms in keyword_terms if len(terms) > 0 and terms <= words]
+
+
+def count_subcrawler(tweet_stats_dir, hours, keywords, languages):
+    """Count the tweets of a subcrawler per (set of matched keywords, language) pattern, per hour.
+    :param keywords: all keywords, a tweet collected for some of them is counted under all keywords it matches
+    :return: dict of {hour: (number of tweets, number of missing tweets, Counter of {(frozenset of keywords, language): number of tweets})}"""
+    keyword_terms = [(keyword, tokenize(keyword)) for keyword in keywords]
+    hour_files = {split_codec_path(f)[0]: f for f in os.listdir(tweet_stats_dir) if split_codec_path(f)[1] is not None}
+    hour_counts = {}
+    last_track = 0
+    sorted_hours = sorted(hour_files)
+    # the hour before the recent hours is only read for its last track
+    first_idx = max(min([i for i, hour in enumerate(sorted_hours) if hour in hours], default=0) - 1, 0)
+    for hour in sorted_hours[first_idx:]:
+        num_tweet = 0
+        num_miss = 0
+        cell_counter = Counter()
+        with codec_open(os.path.join(tweet_stats_dir, hour_files[hour]), 'rt') as fin:
+            for line in fin:
+                split_line = line.rstrip('\n').split(',')
+                if split_line[0].startswith('ratemsg'):
+                    # track counts the tweets missed since the connection started, a decrease is a new connection
+                    track = int(split_line[2])
+                    num_miss += track - last_track if track > last_track else track
+                    last_track = track
+                    continue
+                num_tweet += 1
+                if hour not in hours:
+                    continue
+                lang = split_line[lang_idx]
+                if len(languages) > 0 and lang not in languages:
+                    continue
+                matched = match_keywords(tokenize(' '.join(split_line[i] for i in matched_idx)), keyword_terms)
+                if len(matched) > 0:
+                    cell_counter[(frozenset(matched), lang)] += 1
+        if hour in hours:
+            hour_counts[hour] = (num_tweet, num_miss, cell_counter)
+    return hour_counts
+
+
+def estimate_volumes(subcrawler_counts, hours, percentile=95):
+    """Estimate the hourly volume of every (set of matched keywords, language) pattern at a percentile of the recent hours.
+    The volume in an hour is the count in a subcrawler divided by its sampling rate in that hour,
+    the largest over the subcrawlers that collected the pattern.
+    :return: dict of {(frozenset of keywords, language): volume}"""
+    hourly_volumes = {}
+    for hour_counts in subcrawler_counts.values():
+        for hour, (num_tweet, num_miss, cell_counter) in hour_counts.items():
+            sampling_rate = num_tweet / (num_tweet + num_miss) if num_tweet > 0 else 1
+            for cell, count in cell_counter.items():
+                cell_volumes = hourly_volumes.setdefault(cell, {})
+                cell_volumes[hour] = max(cell_volumes.get(hour, 0), count / sampling_rate)
+    return {cell: float(np.percentile([cell_volumes.get(hour, 0) for hour in hours], percentile))
+            for cell, cell_volumes in hourly_volumes.items()}
+
+
+def estimate_capacity(subcrawler_counts):
+    """Estimate the hourly number of tweets a subcrawler receives at the rate limit, the median over rate limited hours."""
+    limited_counts = [num_tweet for hour_counts in subcrawler_counts.values()
+                      for num_tweet, num_miss, _ in hour_counts.values() if num_miss > 0]
+    if len(limited_counts) == 0:
+        raise ValueError('No subcrawler was rate limited in the recent hours, set the capacity instead')
+    return float(np.median(limited_counts))
+
+
+def format_conf(configs):
+    """Format a crawler conf as the hand-written confs, one line per entry of each subcrawler."""
+    lines = []
+    for name, value in configs.items():
+        key = '{0}: '.format(json.dumps(name))
+        if isinstance(value, dict) and name.startswith('crawler'):
+            indent = ' ' * (len(key) + 2)
+            entries = ['{0}: {1}'.format(json.dumps(k), json.dumps(v, ensure_ascii=False)) for k, v in value.items()]
+            lines.append(key + '{' + (',\n' + indent).join(entries) + '}')
+        else:
+            lines.append(key + json.dumps(value, ensure_ascii=False))
+    return '{' + ',\n '.join(lines) + '\n}\n'
+
+
+def main():
+    app_name = 'covid'
+    conf_path = '../conf/{0}_crawler.conf'.format(app_name)
+    key_path = '../conf/developer.key'
+    archive_dir = '../data/{0}_out'.format(app_name)
+    output_path = '../conf/{0}_crawler.planned.conf'.format(app_name)
+    # number of most recent hours the volumes are estimated from
+    num_hour = 24 * 7
+    # percentile of the hourly volumes to plan for, higher leaves room for bursts
+    percentile = 95
+    # tweets per hour a subcrawler receives before being rate limited, None estimates it from the rate limited hours
+    capacity = None
+    # fraction of the capacity each subcrawler is planned to use
+    headroom = 0.8
+
+    timer = Timer()
+    timer.start()
+
+    with open(conf_path, 'r') as fin:
+        configs = json.load(fin)
+    crawler_confs = [configs['crawler{0}'.format(i)] for i in range(len([k for k in configs if k.startswith('crawler')]))]
+    all_keywords = []
+    all_languages = []
+    for crawler_conf in crawler_confs:
+        all_keywords.extend(keyword for keyword in crawler_conf['keywords'] if keyword not in all_keywords)
+        all_languages.extend(lang for lang in crawler_conf['languages'] if lang not in all_languages)
+
+    tweet_stats_dirs = {}
+    for crawler_conf in crawler_confs:
+        tweet_stats_dir = os.path.join(archive_dir, crawler_conf['crawler_name'], 'tweet_stats')
+        if os.path.isdir(tweet_stats_dir):
+            tweet_stats_dirs[crawler_conf['crawler_name']] = tweet_stats_dir
+        else:
+            print('>>> no tweet_stats for subcrawler {0}, skipped'.format(crawler_conf['crawler_name']))
+    all_hours = set()
+    for tweet_stats_dir in tweet_stats_dirs.values():
+        all_hours.update(split_codec_path(f)[0] for f in os.listdir(tweet_stats_dir) if split_codec_path(f)[1] is not None)
+    hours = sorted(all_hours)[-num_hour:]
+    if len(hours) == 0:
+        sys.exit('>>> no tweet_stats files under {0}, run tweet_extractor.py on the crawled data first'.format(archive_dir))
+    print('>>> estimating volumes over {0} hours, {1} to {2}'.format(len(hours), hours[0], hours[-1]))
+
+    subcrawler_counts = {}
+    for crawler_conf in crawler_confs:
+        if crawler_conf['crawler_name'] in tweet_stats_dirs:
+            subcrawler_counts[crawler_conf['crawler_name']] = count_subcrawler(tweet_stats_dirs[crawler_conf['crawler_name']], set(hours),
+                                                                               all_keywords, crawler_conf['languages'])
+    volumes = estimate_volumes(subcrawler_counts, hours, percentile=percentile)
+    # languages seen in the tweets of subcrawlers tracking all languages, undetermined ones cannot be tracked
+    all_languages.extend(sorted({lang for _, lang in volumes if lang not in all_languages}))
+    all_languages = [lang for lang in all_languages if lang not in undetermined_languages]
+
+    if capacity is None:
+        capacity = estimate_capacity(subcrawler_counts)
+    print('>>> capacity {0:.0f} tweets per hour, planned at {1:.0%}'.format(capacity, headroom))
+    plan = plan_partition(volumes, all_keywords, all_languages, capacity * headroom)
+
+    # the subcrawler tracking all keywords in all languages stays as crawler0, the reference of the sampling rates
+    planned_configs = {'app_name': app_name}
+    if 'codec' in configs:
+        planned_configs['codec'] = configs['codec']
+    planned_configs['crawler0'] = {'crawler_name': '{0}_all'.format(app_name), 'key_set': crawler_confs[0]['key_set'],
+                                   'keywords': all_keywords, 'languages': []}
+    key_sets = [crawler_conf['key_set'] for crawler_conf in crawler_confs[1:]]
+    if os.path.exists(key_path):
+        with open(key_path, 'r') as fin:
+            key_sets.extend(key_set for key_set in json.load(fin) if key_set not in key_sets and key_set != crawler_confs[0]['key_set'])
+    for i, (keywords, languages, volume) in enumerate(plan):
+        key_set = key_sets[i] if i < len(key_sets) else 'key{0}'.format(len(crawler_confs) + i)
+        planned_configs['crawler{0}'.format(i + 1)] = {'crawler_name': '{0}_{1}'.format(app_name, i + 1), 'key_set': key_set,
+                                                       'keywords': keywords, 'languages': languages}
+        print('>>> subcrawler {0}_{1: <3}, {2: >3d} keywords, {3: >3d} languages, {4: >9.0f} tweets per hour, {5: >6.2f}% of capacity{6}'
+              .format(app_name, i + 1, len(keywords), len(languages), volume, 100 * volume / capacity,
+                      ', rate limited' if volume > capacity else ''))
+    print('>>> {0} subcrawlers planned, {1} currently'.format(len(plan), len(crawler_confs) - 1))
+    if len(plan) > len(key_sets):
+        print('>>> {0} more keys than available in {1} are needed'.format(len(plan) - len(key_sets), key_path))
+
+    with open(output_path, 'w') as fout:
+        fout.write(format_conf(planned_configs))
+    print('>>> plan written into {0}'.format(output_path))
+
+    timer.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+""" Decoders of raw tweet lines into dictionaries, as read by TweetExtractor.
+'json' is the standard library, 'orjson' and 'msgspec' decode the whole tweet faster if installed,
+'projection' uses msgspec to only materialize the fields TweetExtractor reads, other fields are skipped while parsing.
+parse_ratemsg and is_control_message recognize rate limit messages and other non-tweet lines without decoding them.
+"""
+
+import re, json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+    # the projection types need TypedDict of Python 3.8, as msgspec does
+    from analysis.tweet_projection import Tweet
+except ImportError:
+    msgspec = None
+
+decoder_backends = ['json', 'orjson', 'msgspec', 'projection']
+
+# {"limit":{"track":283540,"timestamp_ms":"1483189188944"}}, other layouts fall back to the decoders
+ratemsg_pattern = re.compile(rb'^\{"limit":\{"track":(\d+),"timestamp_ms":"(\d+)"\}\}\s*$')
+# stream messages without a top-level id_str, which TweetExtractor skips, and the drop lines of utils.batch_writer
+control_prefixes = (b'{"delete":', b'{"scrub_geo":', b'{"status_withheld":', b'{"user_withheld":', b'{"disconnect":', b'{"warning":',
+                    b'{"drop":')
+
+
+def get_decoder(backend='auto'):
+    """Return a function decoding a raw tweet line (bytes or str) into a dictionary.
+    :param backend: one of decoder_backends, or 'auto' for the fastest installed full decoder"""
+    if backend == 'auto':
+        if orjson is not None:
+            backend = 'orjson'
+        elif msgspec is not None:
+            backend = 'msgspec'
+        else:
+            backend = 'json'
+
+    if backend == 'json':
+        return json.loads
+    elif backend == 'orjson':
+        if orjson is None:
+            raise ImportError('orjson decoder requires the orjson package')
+        return orjson.loads
+    elif backend == 'msgspec' or backend == 'projection':
+        if msgspec is None:
+            raise ImportError('{0} decoder requires the msgspec package'.format(backend))
+        return msgspec.json.Decoder(Tweet if backend == 'projection' else Any).decode
+    else:
+        raise ValueError('Unknown decoder {0}, choose from {1}'.format(backend, ['auto'] + decoder_backends))
+
+
+def parse_ratemsg(line):
+    """Return (timestamp_ms, track) of a raw rate limit message line in bytes, None if the line is not one in the usual layout."""
+    if not line.startswith(b'{"limit":'):
+        return None
+    match = ratemsg_pattern.match(line)
+    if match is None:
+        return None
+    return match.group(2).decode('ascii'), int(match.group(1))
+
+
+def is_control_message(line):
+    """Whether a raw line in bytes is a delete, scrub_geo, withheld, disconnect, warning or drop message."""
+    return line.startswith(control_prefixes)
@@ -21,18 +21,68 @@
 2. ratemsg, timestamp_ms, track
 """
 
-import sys, os, bz2, re, json, logging, logging.config
-from multiprocessing import Process, Queue
+import sys, os, re, time, logging, logging.config
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
-from utils.helper import strify, str2obj, obj2str
+from utils.helper import tweet_date, sort_suffixes
+from utils.dedup import TweetIdSet
+from utils.parallel_bz2 import ParallelBZ2Reader, ParallelBZ2Writer
+from utils.codec import codec_open, codec_path, split_codec_path, detect_codec
+from utils.manifest import file_crc32, load_manifest, save_manifest, is_unchanged
+from utils.follow import FollowReader
+from analysis.tweet_decoder import get_decoder, parse_ratemsg, is_control_message
+from analysis.tweet_writer import TweetTextWriter, TweetParquetWriter, TimestampTextWriter, TimestampRunWriter
+
+
+def _extract_vid_from_expanded_url(expanded_url):
+    if 'watch?' in expanded_url and 'v=' in expanded_url:
+        vid = expanded_url.split('v=')[1][:11]
+    elif 'youtu.be' in expanded_url:
+        vid = expanded_url.rsplit('/', 1)[-1][:11]
+    else:
+        return None
+    # valid condition: contains only alphanumeric, dash or underline
+    valid = re.match('^[\w-]+$', vid) is not None
+    if valid and len(vid) == 11:
+        return vid
+    return None
+
+
+# entity types collected from each tweet layer: (name, key in entities, key of the value in each entity, conversion of the value)
+# the original tweet is read from its entities, retweeted and quoted tweets also from their extended_tweet.entities
+# entities without a value, or whose value converts to None, are skipped
+# the types are the entity columns of tweet_fields in tweet_writer.py, so the table is fixed with the output schema,
+# another type, e.g. ('symbols', 'symbols', 'text', None), also needs its fields there, its key in Entities of tweet_projection.py,
+# and its sets in the record written by _extract_lines()
+entity_types = [('vids', 'urls', 'expanded_url', _extract_vid_from_expanded_url),
+                ('mentions', 'user_mentions', 'id_str', None),
+                ('hashtags', 'hashtags', 'text', None)]
+
+
+def _until_truncated(lines, truncation):
+    """Yield the lines of a compressed file up to its last complete line,
+    the EOFError of a file that ended before its end-of-stream marker is appended to truncation."""
+    try:
+        yield from lines
+    except EOFError as e:
+        truncation.append(e)
 
 
 class TweetExtractor(object):
     """ Tweet Object Extractor Class.
 
-    :param input_dir: directory that contains all tweet bz2 files
+    :param input_dir: directory that contains all tweet files, compressed in any codec of utils.codec
     :param output_dir: directory that composes of 2 folders -- tweet_stats and user_stats
+    :param proc_num: number of processes, each extracts one file at a time, largest files first
+    :param bz2_threads: number of threads decompressing and compressing blocks of one bz2 file
+                        use proc_num=24, bz2_threads=1 for many files on one core each,
+                        or proc_num=1, bz2_threads=24 for one big file on many cores
+    :param codec: codec of the output tweet_stats files
+    :param output_format: 'text' for comma-joined lines, or 'parquet' for typed columns, see tweet_writer.py
+    :param fused: write sorted and deduplicated id/timestamp runs into ts_runs folder instead of timestamp folder,
+                  merge_subcrawlers.py then only k-way merges them
+    :param decoder: decoder of raw tweet lines, 'auto', 'json', 'orjson', 'msgspec' or 'projection', see tweet_decoder.py
 
     For a tweet, the dictionaries must include the following fields:
 
@@ -57,10 +107,17 @@ class TweetExtractor(object):
                       extended_tweet: entities: urls: expanded_url
     """
 
-    def __init__(self, input_dir, output_dir, proc_num=1):
+    def __init__(self, input_dir, output_dir, proc_num=1, bz2_threads=1, codec='bz2', output_format='text', fused=False, decoder='auto'):
         self.input_dir = input_dir
         self.output_dir = output_dir
         self.proc_num = proc_num
+        self.bz2_threads = bz2_threads
+        self.codec = codec
+        self.output_format = output_format
+        self.fused = fused
+        self.decoder = decoder
+        self.max_retries = 2
+        self.suffix_index = {}
 
         os.makedirs(self.output_dir, exist_ok=True)
         self.logger = None
@@ -70,6 +127,34 @@ class TweetExtractor(object):
         """Set the number of processes used in extracting."""
         self.proc_num = n
 
+    def set_max_retries(self, n):
+        """Set the number of times a failed file is extracted again."""
+        self.max_retries = n
+
+    def set_bz2_threads(self, n):
+        """Set the number of threads used in decompressing and compressing one bz2 file."""
+        self.bz2_threads = n
+
+    def set_codec(self, codec):
+        """Set the codec of output tweet_stats files."""
+        self.codec = codec
+
+    def set_output_format(self, output_format):
+        """Set the format of output tweet_stats files, 'text' or 'parquet'."""
+        self.output_format = output_format
+
+    def set_fused(self, fused):
+        """Set whether to write sorted id/timestamp runs for merging, instead of timestamp files."""
+        self.fused = fused
+
+    def set_decoder(self, decoder):
+        """Set the decoder of raw tweet lines, see tweet_decoder.py."""
+        self.decoder = decoder
+
+    def _output_signature(self):
+        """Return the settings that shape the outputs, recorded in manifest entries so that a change of them re-extracts."""
+        return {'output_format': self.output_format, 'codec': self.codec, 'fused': self.fused}
+
     def _setup_logger(self, logger_name):
         """Set logger from conf file."""
         log_dir = '../log/'
@@ -88,135 +173,34 @@ class TweetExtractor(object):
     def _replace_comma_space(text):
         return re.sub(',\\s*|\s+', ' ', text)
 
-    @staticmethod
-    def _extract_vid_from_expanded_url(expanded_url):
-        if 'watch?' in expanded_url and 'v=' in expanded_url:
-            vid = expanded_url.split('v=')[1][:11]
-        elif 'youtu.be' in expanded_url:
-            vid = expanded_url.rsplit('/', 1)[-1][:11]
-        else:
-            return None
-        # valid condition: contains only alphanumeric, dash or underline
-        valid = re.match('^[\w-]+$', vid) is not None
-        if valid and len(vid) == 11:
-            return vid
-        return None
-
-    def _expanded_urls(self, urls):
-        expanded_urls = []
-        for url in urls:
-            if url['expanded_url'] is not None:
-                expanded_urls.append(url['expanded_url'])
-
-        vids = set()
-        for expanded_url in expanded_urls:
-            vid = self._extract_vid_from_expanded_url(expanded_url)
-            if vid is not None:
-                vids.add(vid)
-        return vids
-
-    def _extract_vids(self, tweet):
-        original_urls = []
-        retweeted_urls = []
-        quoted_urls = []
-        try:
-            original_urls.extend(tweet['entities']['urls'])
-        except KeyError:
-            pass
-        try:
-            retweeted_urls.extend(tweet['retweeted_status']['entities']['urls'])
-        except KeyError:
-            pass
-        try:
-            retweeted_urls.extend(tweet['retweeted_status']['extended_tweet']['entities']['urls'])
-        except KeyError:
-            pass
-        try:
-            quoted_urls.extend(tweet['quoted_status']['entities']['urls'])
-        except KeyError:
-            pass
-        try:
-            quoted_urls.extend(tweet['quoted_status']['extended_tweet']['entities']['urls'])
-        except KeyError:
-            pass
-
-        original_vids = self._replace_with_nan(self._expanded_urls(original_urls))
-        retweeted_vids = self._replace_with_nan(self._expanded_urls(retweeted_urls))
-        quoted_vids = self._replace_with_nan(self._expanded_urls(quoted_urls))
-        return original_vids, retweeted_vids, quoted_vids
-
-    def _extract_hashtags(self, tweet):
-        original_hashtags = set()
-        retweeted_hashtags = set()
-        quoted_hashtags = set()
-        try:
-            for hashtag in tweet['entities']['hashtags']:
-                original_hashtags.add(hashtag['text'])
-        except KeyError:
-            pass
-        try:
-            for hashtag in tweet['retweeted_status']['entities']['hashtags']:
-                retweeted_hashtags.add(hashtag['text'])
-        except KeyError:
-            pass
-        try:
-            for hashtag in tweet['retweeted_status']['extended_tweet']['entities']['hashtags']:
-                retweeted_hashtags.add(hashtag['text'])
-        except KeyError:
-            pass
-        try:
-            for hashtag in tweet['quoted_status']['entities']['hashtags']:
-                quoted_hashtags.add(hashtag['text'])
-        except KeyError:
-            pass
-        try:
-            for hashtag in tweet['quoted_status']['extended_tweet']['entities']['hashtags']:
-                quoted_hashtags.add(hashtag['text'])
-        except KeyError:
-            pass
-        original_hashtags = self._replace_with_nan(original_hashtags)
-        retweeted_hashtags = self._replace_with_nan(retweeted_hashtags)
-        quoted_hashtags = self._replace_with_nan(quoted_hashtags)
-        return original_hashtags, retweeted_hashtags, quoted_hashtags
-
-    def _extract_mentions(self, tweet):
-        original_mentions = set()
-        retweeted_mentions = set()
-        quoted_mentions = set()
-        try:
-            for user_mention in tweet['entities']['user_mentions']:
-                if user_mention['id_str'] is not None:
-                    original_mentions.add(user_mention['id_str'])
-        except KeyError:
-            pass
-        try:
-            for user_mention in tweet['retweeted_status']['entities']['user_mentions']:
-                if user_mention['id_str'] is not None:
-                    retweeted_mentions.add(user_mention['id_str'])
-        except KeyError:
-            pass
-        try:
-            for user_mention in tweet['retweeted_status']['extended_tweet']['entities']['user_mentions']:
-                if user_mention['id_str'] is not None:
-                    retweeted_mentions.add(user_mention['id_str'])
-        except KeyError:
-            pass
-        try:
-            for user_mention in tweet['quoted_status']['entities']['user_mentions']:
-                if user_mention['id_str'] is not None:
-                    quoted_mentions.add(user_mention['id_str'])
-        except KeyError:
-            pass
-        try:
-            for user_mention in tweet['quoted_status']['extended_tweet']['entities']['user_mentions']:
-                if user_mention['id_str'] is not None:
-                    quoted_mentions.add(user_mention['id_str'])
-        except KeyError:
-            pass
-        original_mentions = self._replace_with_nan(original_mentions)
-        retweeted_mentions = self._replace_with_nan(retweeted_mentions)
-        quoted_mentions = self._replace_with_nan(quoted_mentions)
-        return original_mentions, retweeted_mentions, quoted_mentions
+    def _extract_entity_sets(self, tweet):
+        """Collect every entity type of entity_types from the original, retweeted and quoted tweets,
+        visiting each entities dictionary once.
+        :return: dict of {name: (original set, retweeted set, quoted set)}, an empty set is 'N'"""
+        layers = [(tweet.get('entities'),)]
+        for field in ('retweeted_status', 'quoted_status'):
+            status = tweet.get(field)
+            if status is None:
+                layers.append(())
+            else:
+                layers.append((status.get('entities'), status.get('extended_tweet', {}).get('entities')))
+
+        entity_sets = {name: [] for name, _, _, _ in entity_types}
+        for layer in layers:
+            layer_sets = {name: set() for name, _, _, _ in entity_types}
+            for entities in layer:
+                if entities is None:
+                    continue
+                for name, entities_key, value_key, convert in entity_types:
+                    for entity in entities.get(entities_key, ()):
+                        value = entity.get(value_key)
+                        if value is not None and convert is not None:
+                            value = convert(value)
+                        if value is not None:
+                            layer_sets[name].add(value)
+            for name, values in layer_sets.items():
+                entity_sets[name].append(self._replace_with_nan(values))
+        return entity_sets
 
     def _extract_entities(self, tweet, field):
         if field in tweet:
@@ -276,186 +260,382 @@ class TweetExtractor(object):
     def extract(self):
         self.logger.debug('**> Start extracting tweet status from tweet bz2 files...')
 
-        processes = []
-        filequeue = Queue()
-
         for root, dirs, files in os.walk(self.input_dir):
             for base_dir in dirs:
                 output_tweet_dir = os.path.join(self.output_dir, base_dir, 'tweet_stats')
                 os.makedirs(output_tweet_dir, exist_ok=True)
-                output_ts_dir = os.path.join(self.output_dir, base_dir, 'timestamp')
+                output_ts_dir = os.path.join(self.output_dir, base_dir, 'ts_runs' if self.fused else 'timestamp')
                 os.makedirs(output_ts_dir, exist_ok=True)
 
+        # rate limit messages are keyed by the subcrawler index in the merging order
+        base_dirs = next(os.walk(self.input_dir))[1]
+        self.suffix_index = {suffix: idx for idx, suffix in enumerate(sort_suffixes([base_dir.split('_')[-1] for base_dir in base_dirs]))}
+
+        # input files whose size and mtime (or crc32) match their manifest entry, whose outputs exist,
+        # and whose outputs were written in the current output format, codec and mode, are skipped,
+        # except a partial hour that is no longer the newest one, its crawler stopped writing it
+        manifest_path = os.path.join(self.output_dir, 'manifest.json')
+        manifest = load_manifest(manifest_path)
+        signature = self._output_signature()
+        filepaths = []
+        signatures = {}
+        num_status = {'truncated': 0, 'partial': 0, 'failed': 0}
+        # the newest hour of each subcrawler may still be written by the crawler
+        newest_hours = set()
         for subdir, _, files in os.walk(self.input_dir):
-            for f in sorted(files):
-                filename, filetype = os.path.join(subdir, f).split('.')
-                base_dir, filename = filename.split('/')[-2:]
-                if filetype == 'bz2':
-                    output_tweet_path = os.path.join(self.output_dir, base_dir, 'tweet_stats', '{0}.bz2'.format(filename))
-                    if not os.path.exists(output_tweet_path):
-                        filequeue.put(os.path.join(subdir, f))
-
-        for w in range(self.proc_num):
-            p = Process(target=self._extract_tweet, args=(filequeue,))
-            p.daemon = True
-            p.start()
-            processes.append(p)
-
-        for p in processes:
-            p.join()
-
-        self.logger.debug('**> Finish extracting tweet status from tweet bz2 files.')
-
-    def _extract_tweet(self, filequeue):
-        while not filequeue.empty():
-            filepath = filequeue.get()
-            try:
-                filedata = bz2.BZ2File(filepath, mode='r')
-            except:
-                self.logger.warn('Exists corrupted bz2 file {0} in dataset folder'.format(filepath))
-                continue
-            filename, filetype = filepath.split('.')
-            base_dir, filename = filename.split('/')[-2:]
-            suffix = base_dir.split('_')[-1]
-
-            tweet_output_path = os.path.join(self.output_dir, base_dir, 'tweet_stats', '{0}.bz2'.format(filename))
-            tweet_output = bz2.open(tweet_output_path, 'wt')
-            ts_output_path = os.path.join(self.output_dir, base_dir, 'timestamp', '{0}.txt'.format(filename))
-            ts_output = open(ts_output_path, 'w')
-
-            visited_tid = set()
-            for line in filedata:
-                try:
-                    if line.rstrip():
-                        tweet_json = json.loads(line)
-
-                        # 2. ratemsg, timestamp_ms, track
-                        if 'limit' in tweet_json:
-                            # rate limit message
-                            # {"limit":{"track":283540,"timestamp_ms":"1483189188944"}}
-                            ratemsg_ts = tweet_json['limit']['timestamp_ms']
-                            ratemsg_track = tweet_json['limit']['track']
-                            tweet_output.write('{0}_{1},{2},{3}\n'.format('ratemsg', suffix, ratemsg_ts, ratemsg_track))
-                            ts_output.write('{2},{0}_{1},{3}\n'.format('ratemsg', suffix, ratemsg_ts, ratemsg_track))
+            hour_files = sorted(f for f in files if split_codec_path(f)[1] is not None)
+            if len(hour_files) > 0:
+                newest_hours.add(os.path.join(subdir, hour_files[-1]))
+            for f in hour_files:
+                filepath = os.path.join(subdir, f)
+                key = os.path.relpath(filepath, self.input_dir)
+                stat = os.stat(filepath)
+                entry = manifest.get(key)
+                if entry is not None and entry['status'] != 'failed' \
+                        and (entry['status'] != 'partial' or filepath in newest_hours) \
+                        and all(entry.get(name) == value for name, value in signature.items()) \
+                        and all(os.path.exists(os.path.join(self.output_dir, output)) for output in entry['outputs']) \
+                        and is_unchanged(entry, filepath, stat.st_size, stat.st_mtime_ns):
+                    entry['mtime_ns'] = stat.st_mtime_ns
+                    if entry['status'] == 'partial':
+                        num_status['partial'] += 1
+                    continue
+                filepaths.append(filepath)
+                signatures[filepath] = (key, stat.st_size, stat.st_mtime_ns)
+
+        # largest files first, so that the burst hours do not run alone at the end
+        pending = sorted(filepaths, key=os.path.getsize, reverse=True)
+        num_attempt = {filepath: 0 for filepath in filepaths}
+        busy_time = {}
+        num_file = {}
+        start_time = time.time()
+        while len(pending) > 0:
+            failed = []
+            # a worker killed by the system breaks the pool, remaining files are retried in a new pool
+            with ProcessPoolExecutor(max_workers=self.proc_num) as executor:
+                futures = {executor.submit(self._extract_file, filepath, signatures[filepath][1], filepath in newest_hours): filepath
+                           for filepath in pending}
+                for future in as_completed(futures):
+                    filepath = futures[future]
+                    key, size, mtime_ns = signatures[filepath]
+                    try:
+                        stats = future.result()
+                    except Exception as e:
+                        if isinstance(e, EOFError) and filepath in newest_hours:
+                            # its last stream is incomplete, the hour is extracted again once it has changed
+                            self.logger.warning('Skip {0} as it is still being written: {1!r}'.format(filepath, e))
+                            manifest[key] = dict(signature, size=size, mtime_ns=mtime_ns, crc32=None, status='partial', error=repr(e), outputs=[])
+                            save_manifest(manifest_path, manifest)
+                            num_status['partial'] += 1
                             continue
-
-                        if 'id_str' not in tweet_json:
-                            continue
-
-                        # 1. tweet_id_str, created_at, timestamp_ms, user_id_str,
-                        #    original_lang, retweeted_lang, quoted_lang,
-                        #    original_vids, retweeted_vids, quoted_vids,
-                        #    original_mentions, retweeted_mentions, quoted_mentions,
-                        #    original_hashtags, retweeted_hashtags, quoted_hashtags,
-                        #    original_geoname, retweeted_geoname, quoted_geoname,
-                        #    original_countrycode, retweeted_countrycode, quoted_countrycode,
-                        #    original_filter, retweeted_filter, quoted_filter,
-                        #    original_retweet_count, retweeted_retweet_count, quoted_retweet_count,
-                        #    original_favorite_count, retweeted_favorite_count, quoted_favorite_count,
-                        #    original_user_followers_count, retweeted_user_followers_count, quoted_user_followers_count,
-                        #    original_user_friends_count, retweeted_user_friends_count, quoted_user_friends_count,
-                        #    original_user_statuses_count, retweeted_user_statuses_count, quoted_user_statuses_count,
-                        #    original_user_favourites_count, retweeted_user_favourites_count, quoted_user_favourites_count,
-                        #    reply_tweet_id_str, retweeted_tweet_id_str, quoted_tweet_id_str,
-                        #    reply_user_id_str, retweeted_user_id_str, quoted_user_id_str,
-                        #    original_text, retweeted_text, quoted_text
-                        tweet_id = tweet_json['id_str']
-                        if tweet_id in visited_tid:
-                            continue
-
-                        created_at = obj2str(str2obj(tweet_json['created_at'], fmt='tweet'), fmt='youtube')
-                        timestamp_ms = tweet_json['timestamp_ms']
-                        user_id_str = tweet_json['user']['id_str']
-                        if 'lang' in tweet_json:
-                            lang = tweet_json['lang']
-                        else:
-                            lang = 'N'
-
-                        original_vids, retweeted_vids, quoted_vids = self._extract_vids(tweet_json)
-                        original_mentions, retweeted_mentions, quoted_mentions = self._extract_mentions(tweet_json)
-                        original_hashtags, retweeted_hashtags, quoted_hashtags, = self._extract_hashtags(tweet_json)
-
-                        if tweet_json['place'] is not None:
-                            original_geo = self._replace_comma_space(tweet_json['place']['full_name'])
-                            original_cc = self._replace_comma_space(tweet_json['place']['country_code'])
+                        num_attempt[filepath] += 1
+                        if num_attempt[filepath] <= self.max_retries:
+                            self.logger.warning('Retry {0} after attempt {1} failed: {2!r}'.format(filepath, num_attempt[filepath], e))
+                            failed.append(filepath)
                         else:
-                            original_geo = 'N'
-                            original_cc = 'N'
+                            self.logger.error('Give up {0} after {1} attempts: {2!r}'.format(filepath, num_attempt[filepath], e))
+                            manifest[key] = dict(signature, size=size, mtime_ns=mtime_ns, crc32=None, status='failed', error=repr(e), outputs=[])
+                            save_manifest(manifest_path, manifest)
+                            num_status['failed'] += 1
+                        continue
+                    pid = stats.pop('pid')
+                    busy_time[pid] = busy_time.get(pid, 0) + stats.pop('busy_time')
+                    num_file[pid] = num_file.get(pid, 0) + 1
+                    if stats['status'] == 'truncated':
+                        num_status['truncated'] += 1
+                    # outputs of an earlier run in another format or codec are replaced
+                    if key in manifest:
+                        for output in set(manifest[key]['outputs']) - set(stats['outputs']):
+                            if os.path.exists(os.path.join(self.output_dir, output)):
+                                os.remove(os.path.join(self.output_dir, output))
+                    manifest[key] = dict(stats, size=size, mtime_ns=mtime_ns, **signature)
+                    save_manifest(manifest_path, manifest)
+            pending = sorted(failed, key=os.path.getsize, reverse=True)
+        save_manifest(manifest_path, manifest)
+
+        wall_time = time.time() - start_time
+        for pid in sorted(busy_time):
+            self.logger.debug('Worker {0} extracted {1} files, busy {2:.1f}s of {3:.1f}s, {4:.1f}% utilization'
+                              .format(pid, num_file[pid], busy_time[pid], wall_time, 100 * busy_time[pid] / wall_time))
+        if len(num_file) > 0:
+            print('>>> {0} workers extracted {1} files in {2:.1f}s, {3:.1f}% utilization'
+                  .format(self.proc_num, sum(num_file.values()), wall_time, 100 * sum(busy_time.values()) / wall_time / self.proc_num))
+        print('>>> {0} files extracted, {1} truncated files extracted up to their last complete line, '
+              '{2} hours still being written, {3} files failed'
+              .format(sum(num_file.values()), num_status['truncated'], num_status['partial'], num_status['failed']))
 
-                        original_filter = tweet_json['filter_level']
-
-                        original_retweet_count = tweet_json['retweet_count']
-                        original_favorite_count = tweet_json['favorite_count']
-
-                        original_user_followers_count = tweet_json['user']['followers_count']
-                        original_user_friends_count = tweet_json['user']['friends_count']
-                        original_user_statuses_count = tweet_json['user']['statuses_count']
-                        original_user_favourites_count = tweet_json['user']['favourites_count']
+        self.logger.debug('**> Finish extracting tweet status from tweet bz2 files.')
 
-                        reply_tweet_id_str = self._replace_with_nan(tweet_json['in_reply_to_status_id_str'])
-                        reply_user_id_str = self._replace_with_nan(tweet_json['in_reply_to_user_id_str'])
+    def follow(self, poll_interval=30):
+        """Tail the hourly files that the crawlers are appending to, and append their tweet status every poll_interval seconds.
+
+        Positions are checkpointed in follow_checkpoint.json, so that a restarted follow resumes where it stopped.
+        An hour is finished once a newer hour exists and all its bytes have been read, it is then recorded in the manifest
+        and later extract() runs skip it. Run extract() first for the backlog, and do not run both at the same time.
+        An hour in the manifest is only skipped if a newer hour exists and it has not changed since, so the live hour
+        extracted by extract() is still followed.
+        A restart forgets the tweet ids seen in the current hours and appends the lines after the last checkpoint again,
+        the duplicates are removed by merge_subcrawlers.py.
+        """
+        if self.fused or self.output_format != 'text':
+            raise ValueError('follow mode appends to text tweet_stats and timestamp files, set fused=False and output_format=text')
+        self.logger.debug('**> Start following tweet files...')
+        decode = get_decoder(self.decoder)
+        manifest_path = os.path.join(self.output_dir, 'manifest.json')
+        manifest = load_manifest(manifest_path)
+        checkpoint_path = os.path.join(self.output_dir, 'follow_checkpoint.json')
+        checkpoints = load_manifest(checkpoint_path)
+        # input key -> (FollowReader, TweetIdSet) of the hours being followed
+        followed = {}
+
+        while True:
+            for subdir, _, files in os.walk(self.input_dir):
+                hour_files = sorted(f for f in files if split_codec_path(f)[1] is not None)
+                for f in hour_files:
+                    filepath = os.path.join(subdir, f)
+                    key = os.path.relpath(filepath, self.input_dir)
+                    entry = manifest.get(key)
+                    if entry is not None and entry['status'] != 'failed' and f != hour_files[-1] and key not in followed:
+                        stat = os.stat(filepath)
+                        if entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+                            continue
 
-                        if 'extended_tweet' in tweet_json and 'full_text' in tweet_json['extended_tweet']:
-                            text = self._replace_comma_space(tweet_json['extended_tweet']['full_text'])
-                        elif tweet_json['text'] is not None:
-                            text = self._replace_comma_space(tweet_json['text'])
-                        else:
-                            text = 'N'
-
-                        retweeted_tweet_id_str, retweeted_user_id_str, retweeted_user_location,\
-                        retweeted_lang, retweeted_geo, retweeted_cc, retweeted_filter, \
-                        retweeted_retweet_count, retweeted_favorite_count, retweeted_user_followers_count, \
-                        retweeted_user_friends_count, retweeted_user_statuses_count, retweeted_user_favourites_count, \
-                        retweeted_text = self._extract_entities(tweet_json, 'retweeted_status')
-
-                        quoted_tweet_id_str, quoted_user_id_str, quoted_user_location,\
-                        quoted_lang, quoted_geo, quoted_cc, quoted_filter, \
-                        quoted_retweet_count, quoted_favorite_count, quoted_user_followers_count, \
-                        quoted_user_friends_count, quoted_user_statuses_count, quoted_user_favourites_count, \
-                        quoted_text = self._extract_entities(tweet_json, 'quoted_status')
-
-                        tweet_output.write('{0},{1},{2},{3},'
-                                           '{4},{5},{6},'
-                                           '{7},{8},{9},'
-                                           '{10},{11},{12},'
-                                           '{13},{14},{15},'
-                                           '{16},{17},{18},'
-                                           '{19},{20},{21},'
-                                           '{22},{23},{24},'
-                                           '{25},{26},{27},'
-                                           '{28},{29},{30},'
-                                           '{31},{32},{33},'
-                                           '{34},{35},{36},'
-                                           '{37},{38},{39},'
-                                           '{40},{41},{42},'
-                                           '{43},{44},{45},'
-                                           '{46},{47},{48},'
-                                           '{49},{50},{51}\n'
-                                           .format(tweet_id, created_at, timestamp_ms, user_id_str,
-                                                   lang, retweeted_lang, quoted_lang,
-                                                   strify(original_vids, delimiter=';'), strify(retweeted_vids, delimiter=';'), strify(quoted_vids, delimiter=';'),
-                                                   strify(original_mentions, delimiter=';'), strify(retweeted_mentions, delimiter=';'), strify(quoted_mentions, delimiter=';'),
-                                                   strify(original_hashtags, delimiter=';'), strify(retweeted_hashtags, delimiter=';'), strify(quoted_hashtags, delimiter=';'),
-                                                   original_geo, retweeted_geo, quoted_geo,
-                                                   original_cc, retweeted_cc, quoted_cc,
-                                                   original_filter, retweeted_filter, quoted_filter,
-                                                   original_retweet_count, retweeted_retweet_count, quoted_retweet_count,
-                                                   original_favorite_count, retweeted_favorite_count, quoted_favorite_count,
-                                                   original_user_followers_count, retweeted_user_followers_count, quoted_user_followers_count,
-                                                   original_user_friends_count, retweeted_user_friends_count, quoted_user_friends_count,
-                                                   original_user_statuses_count, retweeted_user_statuses_count, quoted_user_statuses_count,
-                                                   original_user_favourites_count, retweeted_user_favourites_count, quoted_user_favourites_count,
-                                                   reply_tweet_id_str, retweeted_tweet_id_str, quoted_tweet_id_str,
-                                                   reply_user_id_str, retweeted_user_id_str, quoted_user_id_str,
-                                                   text, retweeted_text, quoted_text))
-                        ts_output.write('{0},{1}\n'.format(timestamp_ms, tweet_id))
-                        visited_tid.add(tweet_id)
-
-                except EOFError:
-                    self.logger.error('EOFError: {0} ended before the logical end-of-stream was detected,'.format(filename))
+                    checkpoint = checkpoints.get(key, {'stream_offset': 0, 'consumed': 0, 'num_tweet': 0, 'num_ratemsg': 0})
+                    if key not in followed:
+                        followed[key] = FollowReader(filepath, checkpoint['stream_offset'], checkpoint['consumed']), TweetIdSet()
+                    reader, visited_tid = followed[key]
+                    filename = split_codec_path(f)[0]
+                    base_dir = os.path.basename(subdir)
+                    suffix = base_dir.split('_')[-1]
+                    tweet_output_path = codec_path(os.path.join(self.output_dir, base_dir, 'tweet_stats', filename), self.codec)
+                    ts_output_path = os.path.join(self.output_dir, base_dir, 'timestamp', '{0}.txt'.format(filename))
+
+                    tweet_output = None
+                    ts_output = None
+                    for lines in reader.poll():
+                        if tweet_output is None:
+                            # the first lines of an hour replace outputs of an earlier run, later lines are appended
+                            mode = 'a' if key in checkpoints else 'w'
+                            os.makedirs(os.path.dirname(tweet_output_path), exist_ok=True)
+                            os.makedirs(os.path.dirname(ts_output_path), exist_ok=True)
+                            tweet_output = TweetTextWriter(output=codec_open(tweet_output_path, mode + 't', codec=self.codec))
+                            ts_output = TimestampTextWriter(ts_output_path, mode)
+                        num_tweet, num_ratemsg = self._extract_lines(lines, decode, visited_tid, suffix, filename, tweet_output, ts_output)
+                        checkpoint['num_tweet'] += num_tweet
+                        checkpoint['num_ratemsg'] += num_ratemsg
+                    if tweet_output is not None:
+                        tweet_output.close()
+                        ts_output.close()
+                        checkpoint.update(reader.checkpoint())
+                        checkpoints[key] = checkpoint
+                        save_manifest(checkpoint_path, checkpoints)
+
+                    # the crawler closes an hour before opening the next one, which existed before this poll
+                    if f != hour_files[-1] and reader.at_file_end():
+                        stat = os.stat(filepath)
+                        outputs = [os.path.relpath(tweet_output_path, self.output_dir), os.path.relpath(ts_output_path, self.output_dir)]
+                        manifest[key] = dict(self._output_signature(), size=stat.st_size, mtime_ns=stat.st_mtime_ns, crc32=file_crc32(filepath),
+                                             status='done', num_tweet=checkpoint['num_tweet'], num_ratemsg=checkpoint['num_ratemsg'],
+                                             outputs=outputs if key in checkpoints else [])
+                        save_manifest(manifest_path, manifest)
+                        del followed[key]
+                        if key in checkpoints:
+                            del checkpoints[key]
+                            save_manifest(checkpoint_path, checkpoints)
+                        self.logger.debug('{0} done!'.format(filepath))
+                        print('{0} done!'.format(filepath))
+            time.sleep(poll_interval)
+
+    def _extract_file(self, filepath, size, live):
+        """Extract one raw tweet file, return its manifest entry along with the worker pid and its busy time in seconds.
+        A truncated file is extracted up to its last complete line with status 'truncated',
+        unless it is live, i.e. the newest hour of its subcrawler, which raises EOFError as it may still be written."""
+        start_time = time.time()
+        crc32 = file_crc32(filepath, size)
+        decode = get_decoder(self.decoder)
+        try:
+            if self.bz2_threads > 1 and detect_codec(filepath) == 'bz2':
+                filedata = ParallelBZ2Reader(filepath, num_threads=self.bz2_threads)
+            else:
+                filedata = codec_open(filepath, 'rb')
+        except:
+            self.logger.warn('Exists corrupted file {0} in dataset folder'.format(filepath))
+            return {'pid': os.getpid(), 'busy_time': time.time() - start_time,
+                    'crc32': crc32, 'status': 'corrupted', 'num_tweet': 0, 'num_ratemsg': 0, 'outputs': []}
+        filename = split_codec_path(os.path.basename(filepath))[0]
+        base_dir = os.path.basename(os.path.dirname(filepath))
+        suffix = base_dir.split('_')[-1]
+
+        # outputs are written into temporary files and renamed once complete, a killed worker leaves no truncated output
+        tweet_output_base = os.path.join(self.output_dir, base_dir, 'tweet_stats', filename)
+        if self.output_format == 'parquet':
+            tweet_output_path = '{0}.parquet'.format(tweet_output_base)
+            tweet_output = TweetParquetWriter('{0}.tmp'.format(tweet_output_path))
+        elif self.bz2_threads > 1 and self.codec == 'bz2':
+            tweet_output_path = codec_path(tweet_output_base, self.codec)
+            tweet_output = TweetTextWriter(output=ParallelBZ2Writer('{0}.tmp'.format(tweet_output_path), 'wt', num_threads=self.bz2_threads))
+        else:
+            tweet_output_path = codec_path(tweet_output_base, self.codec)
+            tweet_output = TweetTextWriter('{0}.tmp'.format(tweet_output_path), codec=self.codec)
+        if self.fused:
+            ts_output_path = os.path.join(self.output_dir, base_dir, 'ts_runs', '{0}.txt'.format(filename))
+            ts_output = TimestampRunWriter('{0}.tmp'.format(ts_output_path), suffix, self.suffix_index[suffix])
+        else:
+            ts_output_path = os.path.join(self.output_dir, base_dir, 'timestamp', '{0}.txt'.format(filename))
+            ts_output = TimestampTextWriter('{0}.tmp'.format(ts_output_path))
 
+        truncation = []
+        try:
+            lines = filedata if live else _until_truncated(filedata, truncation)
+            num_tweet, num_ratemsg = self._extract_lines(lines, decode, TweetIdSet(), suffix, filename, tweet_output, ts_output)
             tweet_output.close()
             ts_output.close()
+        except Exception:
+            # a failed extraction leaves no temporary outputs behind
+            for output in (tweet_output, ts_output):
+                try:
+                    output.close()
+                except Exception:
+                    pass
+            for tmp_path in ('{0}.tmp'.format(tweet_output_path), '{0}.tmp'.format(ts_output_path)):
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            raise
+        finally:
             filedata.close()
-            self.logger.debug('{0} done!'.format(filepath))
-            print('{0} done!'.format(filepath))
+        os.replace('{0}.tmp'.format(tweet_output_path), tweet_output_path)
+        os.replace('{0}.tmp'.format(ts_output_path), ts_output_path)
+        if len(truncation) > 0:
+            self.logger.warning('{0} is truncated, extracted up to its last complete line: {1!r}'.format(filepath, truncation[0]))
+        self.logger.debug('{0} done!'.format(filepath))
+        print('{0} done!'.format(filepath))
+        return {'pid': os.getpid(), 'busy_time': time.time() - start_time,
+                'crc32': crc32, 'status': 'truncated' if len(truncation) > 0 else 'done', 'num_tweet': num_tweet, 'num_ratemsg': num_ratemsg,
+                'outputs': [os.path.relpath(tweet_output_path, self.output_dir), os.path.relpath(ts_output_path, self.output_dir)]}
+
+    def _extract_lines(self, lines, decode, visited_tid, suffix, filename, tweet_output, ts_output):
+        """Extract raw tweet lines into tweet_output and ts_output, return the number of tweets and rate limit messages."""
+        num_tweet = 0
+        num_ratemsg = 0
+        for line in lines:
+            try:
+                if line.rstrip():
+                    # 2. ratemsg, timestamp_ms, track
+                    # rate limit messages and control messages are recognized from the raw bytes, before decoding
+                    ratemsg = parse_ratemsg(line)
+                    if ratemsg is None:
+                        if is_control_message(line):
+                            continue
+                        tweet_json = decode(line)
+                        if 'limit' in tweet_json:
+                            # rate limit message
+                            # {"limit":{"track":283540,"timestamp_ms":"1483189188944"}}
+                            ratemsg = tweet_json['limit']['timestamp_ms'], tweet_json['limit']['track']
+
+                    if ratemsg is not None:
+                        ratemsg_ts, ratemsg_track = ratemsg
+                        tweet_output.write_ratemsg(suffix, ratemsg_ts, ratemsg_track)
+                        num_ratemsg += 1
+                        ts_output.write_ratemsg(suffix, ratemsg_ts, ratemsg_track)
+                        continue
+
+                    if 'id_str' not in tweet_json:
+                        continue
+
+                    # 1. tweet_id_str, created_at, timestamp_ms, user_id_str,
+                    #    original_lang, retweeted_lang, quoted_lang,
+                    #    original_vids, retweeted_vids, quoted_vids,
+                    #    original_mentions, retweeted_mentions, quoted_mentions,
+                    #    original_hashtags, retweeted_hashtags, quoted_hashtags,
+                    #    original_geoname, retweeted_geoname, quoted_geoname,
+                    #    original_countrycode, retweeted_countrycode, quoted_countrycode,
+                    #    original_filter, retweeted_filter, quoted_filter,
+                    #    original_retweet_count, retweeted_retweet_count, quoted_retweet_count,
+                    #    original_favorite_count, retweeted_favorite_count, quoted_favorite_count,
+                    #    original_user_followers_count, retweeted_user_followers_count, quoted_user_followers_count,
+                    #    original_user_friends_count, retweeted_user_friends_count, quoted_user_friends_count,
+                    #    original_user_statuses_count, retweeted_user_statuses_count, quoted_user_statuses_count,
+                    #    original_user_favourites_count, retweeted_user_favourites_count, quoted_user_favourites_count,
+                    #    reply_tweet_id_str, retweeted_tweet_id_str, quoted_tweet_id_str,
+                    #    reply_user_id_str, retweeted_user_id_str, quoted_user_id_str,
+                    #    original_text, retweeted_text, quoted_text
+                    tweet_id = tweet_json['id_str']
+                    if tweet_id in visited_tid:
+                        continue
+
+                    created_at = tweet_date(tweet_json['created_at'])
+                    timestamp_ms = tweet_json['timestamp_ms']
+                    user_id_str = tweet_json['user']['id_str']
+                    if 'lang' in tweet_json:
+                        lang = tweet_json['lang']
+                    else:
+                        lang = 'N'
+
+                    entity_sets = self._extract_entity_sets(tweet_json)
+                    original_vids, retweeted_vids, quoted_vids = entity_sets['vids']
+                    original_mentions, retweeted_mentions, quoted_mentions = entity_sets['mentions']
+                    original_hashtags, retweeted_hashtags, quoted_hashtags = entity_sets['hashtags']
+
+                    if tweet_json['place'] is not None:
+                        original_geo = self._replace_comma_space(tweet_json['place']['full_name'])
+                        original_cc = self._replace_comma_space(tweet_json['place']['country_code'])
+                    else:
+                        original_geo = 'N'
+                        original_cc = 'N'
+
+                    original_filter = tweet_json['filter_level']
+
+                    original_retweet_count = tweet_json['retweet_count']
+                    original_favorite_count = tweet_json['favorite_count']
+
+                    original_user_followers_count = tweet_json['user']['followers_count']
+                    original_user_friends_count = tweet_json['user']['friends_count']
+                    original_user_statuses_count = tweet_json['user']['statuses_count']
+                    original_user_favourites_count = tweet_json['user']['favourites_count']
+
+                    reply_tweet_id_str = self._replace_with_nan(tweet_json['in_reply_to_status_id_str'])
+                    reply_user_id_str = self._replace_with_nan(tweet_json['in_reply_to_user_id_str'])
+
+                    if 'extended_tweet' in tweet_json and 'full_text' in tweet_json['extended_tweet']:
+                        text = self._replace_comma_space(tweet_json['extended_tweet']['full_text'])
+                    elif tweet_json['text'] is not None:
+                        text = self._replace_comma_space(tweet_json['text'])
+                    else:
+                        text = 'N'
+
+                    retweeted_tweet_id_str, retweeted_user_id_str, retweeted_user_location,\
+                    retweeted_lang, retweeted_geo, retweeted_cc, retweeted_filter, \
+                    retweeted_retweet_count, retweeted_favorite_count, retweeted_user_followers_count, \
+                    retweeted_user_friends_count, retweeted_user_statuses_count, retweeted_user_favourites_count, \
+                    retweeted_text = self._extract_entities(tweet_json, 'retweeted_status')
+
+                    quoted_tweet_id_str, quoted_user_id_str, quoted_user_location,\
+                    quoted_lang, quoted_geo, quoted_cc, quoted_filter, \
+                    quoted_retweet_count, quoted_favorite_count, quoted_user_followers_count, \
+                    quoted_user_friends_count, quoted_user_statuses_count, quoted_user_favourites_count, \
+                    quoted_text = self._extract_entities(tweet_json, 'quoted_status')
+
+                    tweet_output.write_tweet((tweet_id, created_at, timestamp_ms, user_id_str,
+                                              lang, retweeted_lang, quoted_lang,
+                                              original_vids, retweeted_vids, quoted_vids,
+                                              original_mentions, retweeted_mentions, quoted_mentions,
+                                              original_hashtags, retweeted_hashtags, quoted_hashtags,
+                                              original_geo, retweeted_geo, quoted_geo,
+                                              original_cc, retweeted_cc, quoted_cc,
+                                              original_filter, retweeted_filter, quoted_filter,
+                                              original_retweet_count, retweeted_retweet_count, quoted_retweet_count,
+                                              original_favorite_count, retweeted_favorite_count, quoted_favorite_count,
+                                              original_user_followers_count, retweeted_user_followers_count, quoted_user_followers_count,
+                                              original_user_friends_count, retweeted_user_friends_count, quoted_user_friends_count,
+                                              original_user_statuses_count, retweeted_user_statuses_count, quoted_user_statuses_count,
+                                              original_user_favourites_count, retweeted_user_favourites_count, quoted_user_favourites_count,
+                                              reply_tweet_id_str, retweeted_tweet_id_str, quoted_tweet_id_str,
+                                              reply_user_id_str, retweeted_user_id_str, quoted_user_id_str,
+                                              text, retweeted_text, quoted_text))
+                    ts_output.write_tweet(timestamp_ms, tweet_id)
+                    visited_tid.add(tweet_id)
+                    num_tweet += 1
+
+            except EOFError:
+                self.logger.error('EOFError: {0} ended before the logical end-of-stream was detected,'.format(filename))
+        return num_tweet, num_ratemsg
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+""" Fields of a raw tweet materialized by the 'projection' decoder of tweet_decoder.py, other fields are skipped while parsing.
+Requires Python 3.8 for TypedDict, tweet_decoder.py only imports it along with msgspec.
+"""
+
+from typing import Any, List, Optional, TypedDict
+
+
+# the fields read by TweetExtractor, leaves are Any so that unexpected values pass through as json.loads does
+class Url(TypedDict, total=False):
+    expanded_url: Any
+
+
+class Hashtag(TypedDict, total=False):
+    text: Any
+
+
+class UserMention(TypedDict, total=False):
+    id_str: Any
+
+
+class Entities(TypedDict, total=False):
+    urls: List[Url]
+    hashtags: List[Hashtag]
+    user_mentions: List[UserMention]
+
+
+class ExtendedTweet(TypedDict, total=False):
+    full_text: Any
+    entities: Entities
+
+
+class User(TypedDict, total=False):
+    id_str: Any
+    location: Any
+    followers_count: Any
+    friends_count: Any
+    statuses_count: Any
+    favourites_count: Any
+
+
+class Place(TypedDict, total=False):
+    full_name: Any
+    country_code: Any
+
+
+class Status(TypedDict, total=False):
+    id_str: Any
+    created_at: Any
+    user: User
+    lang: Any
+    place: Optional[Place]
+    filter_level: Any
+    retweet_count: Any
+    favorite_count: Any
+    in_reply_to_status_id_str: Any
+    in_reply_to_user_id_str: Any
+    text: Any
+    extended_tweet: ExtendedTweet
+    entities: Entities
+
+
+class Limit(TypedDict, total=False):
+    track: Any
+    timestamp_ms: Any
+
+
+class Tweet(Status, total=False):
+    timestamp_ms: Any
+    limit: Limit
+    retweeted_status: Status
+    quoted_status: Status
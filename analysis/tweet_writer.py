@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+
+""" Writers of extracted tweet status.
+TweetTextWriter writes one comma-joined line per tweet, TweetParquetWriter writes typed columns.
+Both take the 52 fields of a tweet in the order of tweet_fields.
+TimestampTextWriter and TimestampRunWriter write the timestamp files read by merge_subcrawlers.py.
+"""
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+from utils.helper import strify, make_ts_record, is_ratemsg_line
+from utils.codec import codec_open
+from utils.external_sort import write_sorted_run
+
+tweet_fields = ['tweet_id_str', 'created_at', 'timestamp_ms', 'user_id_str',
+                'original_lang', 'retweeted_lang', 'quoted_lang',
+                'original_vids', 'retweeted_vids', 'quoted_vids',
+                'original_mentions', 'retweeted_mentions', 'quoted_mentions',
+                'original_hashtags', 'retweeted_hashtags', 'quoted_hashtags',
+                'original_geoname', 'retweeted_geoname', 'quoted_geoname',
+                'original_countrycode', 'retweeted_countrycode', 'quoted_countrycode',
+                'original_filter', 'retweeted_filter', 'quoted_filter',
+                'original_retweet_count', 'retweeted_retweet_count', 'quoted_retweet_count',
+                'original_favorite_count', 'retweeted_favorite_count', 'quoted_favorite_count',
+                'original_user_followers_count', 'retweeted_user_followers_count', 'quoted_user_followers_count',
+                'original_user_friends_count', 'retweeted_user_friends_count', 'quoted_user_friends_count',
+                'original_user_statuses_count', 'retweeted_user_statuses_count', 'quoted_user_statuses_count',
+                'original_user_favourites_count', 'retweeted_user_favourites_count', 'quoted_user_favourites_count',
+                'reply_tweet_id_str', 'retweeted_tweet_id_str', 'quoted_tweet_id_str',
+                'reply_user_id_str', 'retweeted_user_id_str', 'quoted_user_id_str',
+                'original_text', 'retweeted_text', 'quoted_text']
+
+# fields holding a set of entities, 'N' if empty
+entity_fields = {'original_vids', 'retweeted_vids', 'quoted_vids',
+                 'original_mentions', 'retweeted_mentions', 'quoted_mentions',
+                 'original_hashtags', 'retweeted_hashtags', 'quoted_hashtags'}
+entity_idx = {tweet_fields.index(field) for field in entity_fields}
+mention_idx = {tweet_fields.index(field) for field in entity_fields if field.endswith('_mentions')}
+int_idx = {i for i, field in enumerate(tweet_fields) if field.endswith('_id_str') or field.endswith('_count') or field == 'timestamp_ms'}
+
+
+class TweetTextWriter(object):
+    """ Write tweet status as comma-joined text lines, entities are joined by semicolons.
+
+    :param output_path: path of the output file
+    :param codec: codec of the output file, one of utils.codec
+    :param output: an opened text file object to write into, instead of output_path
+    """
+
+    def __init__(self, output_path=None, codec=None, output=None):
+        if output is None:
+            output = codec_open(output_path, 'wt', codec=codec)
+        self.output = output
+
+    def write_tweet(self, record):
+        self.output.write(','.join([strify(v, delimiter=';') if i in entity_idx else str(v) for i, v in enumerate(record)]) + '\n')
+
+    def write_ratemsg(self, suffix, ratemsg_ts, ratemsg_track):
+        self.output.write('{0}_{1},{2},{3}\n'.format('ratemsg', suffix, ratemsg_ts, ratemsg_track))
+
+    def close(self):
+        self.output.close()
+
+
+def _field_type(field):
+    if field.endswith('_id_str') or field == 'timestamp_ms':
+        return pa.int64()
+    elif field.endswith('_count'):
+        return pa.int32()
+    elif field.endswith('_mentions'):
+        return pa.list_(pa.int64())
+    elif field.endswith('_vids') or field.endswith('_hashtags'):
+        return pa.list_(pa.string())
+    elif field.endswith('_lang') or field.endswith('_countrycode') or field.endswith('_filter') or field == 'created_at':
+        return pa.dictionary(pa.int32(), pa.string())
+    else:
+        return pa.string()
+
+
+class TweetParquetWriter(object):
+    """ Write tweet status as typed columns in a parquet file.
+
+    :param output_path: path of the output parquet file
+    :param row_group_size: number of tweets buffered before writing a row group
+
+    Ids are int64, counts are int32, lang, countrycode, filter and created_at are dictionary-encoded,
+    and vids, mentions and hashtags are list columns. Missing values ('N') are nulls, empty entities are empty lists.
+    Rate limit messages are not kept, they are in the timestamp files.
+    """
+
+    def __init__(self, output_path, row_group_size=100000):
+        if pa is None:
+            raise ImportError('parquet output requires the pyarrow package')
+        self.schema = pa.schema([(field, _field_type(field)) for field in tweet_fields])
+        self.writer = pq.ParquetWriter(output_path, self.schema, compression='zstd')
+        self.row_group_size = row_group_size
+        self.columns = [[] for _ in tweet_fields]
+
+    def write_tweet(self, record):
+        for i, v in enumerate(record):
+            if i in entity_idx:
+                if v == 'N':
+                    v = []
+                elif i in mention_idx:
+                    v = [int(x) for x in v]
+                else:
+                    v = list(v)
+            elif v == 'N' or v is None:
+                v = None
+            elif i in int_idx:
+                v = int(v)
+            self.columns[i].append(v)
+        if len(self.columns[0]) >= self.row_group_size:
+            self._write_row_group()
+
+    def write_ratemsg(self, suffix, ratemsg_ts, ratemsg_track):
+        pass
+
+    def _write_row_group(self):
+        arrays = [pa.array(column, type=self.schema.field(i).type.value_type).dictionary_encode()
+                  if pa.types.is_dictionary(self.schema.field(i).type) else pa.array(column, type=self.schema.field(i).type)
+                  for i, column in enumerate(self.columns)]
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+        self.columns = [[] for _ in tweet_fields]
+
+    def close(self):
+        if len(self.columns[0]) > 0:
+            self._write_row_group()
+        self.writer.close()
+
+
+class TimestampTextWriter(object):
+    """ Write the timestamp and id of tweets and rate limit messages as text lines, in collecting order.
+
+    :param output_path: path of the output text file
+    :param mode: 'w' to write a new file, or 'a' to append
+    """
+
+    def __init__(self, output_path, mode='w'):
+        self.output = open(output_path, mode)
+
+    def write_tweet(self, timestamp_ms, tweet_id):
+        self.output.write('{0},{1}\n'.format(timestamp_ms, tweet_id))
+
+    def write_ratemsg(self, suffix, ratemsg_ts, ratemsg_track):
+        self.output.write('{2},{0}_{1},{3}\n'.format('ratemsg', suffix, ratemsg_ts, ratemsg_track))
+
+    def close(self):
+        self.output.close()
+
+
+class TimestampRunWriter(object):
+    """ Write the timestamp and id of tweets and rate limit messages as a sorted run for merge_subcrawlers.py.
+
+    :param output_path: path of the output run file
+    :param suffix: suffix of the subcrawler
+    :param suffix_idx: index of the subcrawler in the merging order
+
+    Records are keyed as in merge_subcrawlers.py, then sorted and deduplicated when closed,
+    keeping the first seen tweet and the last seen rate limit message of each id.
+    """
+
+    def __init__(self, output_path, suffix, suffix_idx):
+        self.output_path = output_path
+        self.suffix = suffix
+        self.suffix_idx = suffix_idx
+        self.records = []
+
+    def write_tweet(self, timestamp_ms, tweet_id):
+        self.records.append(make_ts_record([timestamp_ms, tweet_id], self.suffix, self.suffix_idx))
+
+    def write_ratemsg(self, suffix, ratemsg_ts, ratemsg_track):
+        self.records.append(make_ts_record([ratemsg_ts, 'ratemsg_{0}'.format(suffix), ratemsg_track], self.suffix, self.suffix_idx))
+
+    def close(self):
+        write_sorted_run(self.output_path, self.records, keep_last=is_ratemsg_line)
+        self.records = []
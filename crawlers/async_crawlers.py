@@ -0,0 +1,262 @@
+import sys, os, ssl, json, time, hmac, uuid, base64, asyncio, hashlib, logging
+from urllib.parse import quote, urlencode, urlsplit
+from multiprocessing import Process
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
+from utils.codec import load_codec_conf
+from utils.batch_writer import BatchWriter
+from utils.reconnect import ReconnectPolicy
+
+stream_url = 'https://stream.twitter.com/1.1/statuses/filter.json'
+
+
+class StreamError(Exception):
+    """ A response of the streaming endpoint other than 200.
+
+    :param status_code: HTTP status code of the response
+    :param reason: reason phrase of the response
+    """
+    def __init__(self, status_code, reason):
+        Exception.__init__(self, 'HTTP {0} {1}'.format(status_code, reason))
+        self.status_code = status_code
+
+
+def _percent_encode(value):
+    return quote(str(value), safe='')
+
+
+def oauth_header(method, url, params, key_token):
+    """Return the OAuth 1.0a Authorization header of a request signed with HMAC-SHA1.
+    :param url: url of the request without its query string
+    :param params: query and form parameters of the request
+    :param key_token: dict of consumer_key, consumer_secret, access_token and access_secret, as in conf/developer.key"""
+    oauth_params = {'oauth_consumer_key': key_token['consumer_key'],
+                    'oauth_nonce': uuid.uuid4().hex,
+                    'oauth_signature_method': 'HMAC-SHA1',
+                    'oauth_timestamp': str(int(time.time())),
+                    'oauth_token': key_token['access_token'],
+                    'oauth_version': '1.0'}
+    encoded_params = sorted((_percent_encode(k), _percent_encode(v)) for k, v in list(params.items()) + list(oauth_params.items()))
+    param_str = '&'.join('{0}={1}'.format(k, v) for k, v in encoded_params)
+    base_str = '&'.join([method.upper(), _percent_encode(url), _percent_encode(param_str)])
+    signing_key = '{0}&{1}'.format(_percent_encode(key_token['consumer_secret']), _percent_encode(key_token['access_secret']))
+    oauth_params['oauth_signature'] = base64.b64encode(hmac.new(signing_key.encode('utf-8'), base_str.encode('utf-8'), hashlib.sha1).digest()).decode('ascii')
+    return 'OAuth ' + ', '.join('{0}="{1}"'.format(_percent_encode(k), _percent_encode(v)) for k, v in sorted(oauth_params.items()))
+
+
+class ResponseBody(object):
+    """ Read the body of a streaming HTTP response as lines and as byte counts, decoding chunked transfer encoding.
+
+    :param reader: asyncio.StreamReader positioned after the response headers
+    :param chunked: whether the body uses chunked transfer encoding
+    :param timeout: seconds without any bytes, keep-alive newlines included, after which watch() closes the connection
+
+    The timeout is checked by watch() rather than by a timeout on every read, which would be paid per chunk.
+    """
+    def __init__(self, reader, chunked, timeout=300):
+        self.reader = reader
+        self.chunked = chunked
+        self.timeout = timeout
+        self.buffer = bytearray()
+        self.eof = False
+        self.last_read_ts = time.monotonic()
+        self.stalled = False
+
+    async def watch(self, stream_writer):
+        """Close the connection of stream_writer once no bytes have arrived for timeout seconds."""
+        while True:
+            await asyncio.sleep(max(self.last_read_ts + self.timeout - time.monotonic(), 0))
+            if time.monotonic() - self.last_read_ts >= self.timeout:
+                self.stalled = True
+                stream_writer.close()
+                return
+
+    async def read_line(self):
+        """Return the bytes up to and including the next newline."""
+        start = 0
+        while True:
+            loc = self.buffer.find(b'\n', start)
+            if loc >= 0:
+                return self._pop(loc + 1)
+            start = len(self.buffer)
+            await self._fill()
+
+    async def read_len(self, length):
+        """Return the next length bytes."""
+        while len(self.buffer) < length:
+            await self._fill()
+        return self._pop(length)
+
+    def _pop(self, length):
+        data = bytes(self.buffer[:length])
+        del self.buffer[:length]
+        return data
+
+    async def _fill(self):
+        if self.eof:
+            raise ConnectionError('Stream closed by the server')
+        try:
+            if self.chunked:
+                size_line = await self.reader.readline()
+                if len(size_line) == 0:
+                    raise ConnectionError('Stream closed by the server')
+                size = int(size_line.split(b';')[0].strip(), 16)
+                if size == 0:
+                    self.eof = True
+                    return
+                chunk = (await self.reader.readexactly(size + 2))[:-2]
+            else:
+                chunk = await self.reader.read(64 * 1024)
+                if len(chunk) == 0:
+                    raise ConnectionError('Stream closed by the server')
+        except (ConnectionError, asyncio.IncompleteReadError):
+            if self.stalled:
+                raise TimeoutError('No data received for {0}s'.format(self.timeout))
+            raise
+        self.last_read_ts = time.monotonic()
+        self.buffer += chunk
+
+
+async def read_stream(crawler_conf, writer, url=stream_url, timeout=300, policy=None):
+    """Connect to the filter endpoint with the keywords and languages of a crawler, and hand every message to writer,
+    until the connection fails. Messages are length delimited as with tweepy, and written as received, ending with \\r\\n.
+    An accepted connection is reported to policy, a ReconnectPolicy, if given."""
+    parts = urlsplit(url)
+    base_url = '{0}://{1}{2}'.format(parts.scheme, parts.netloc, parts.path)
+    query_params = {'delimited': 'length'}
+    body_params = {}
+    if crawler_conf['keywords']:
+        body_params['track'] = ','.join(crawler_conf['keywords'])
+    if crawler_conf['languages']:
+        body_params['language'] = ','.join(crawler_conf['languages'])
+    body = urlencode(body_params).encode('utf-8')
+    authorization = oauth_header('POST', base_url, dict(query_params, **body_params), crawler_conf['key_token'])
+
+    if parts.scheme == 'https':
+        ssl_context = ssl.create_default_context()
+        port = parts.port or 443
+    else:
+        ssl_context = None
+        port = parts.port or 80
+    reader, stream_writer = await asyncio.wait_for(asyncio.open_connection(parts.hostname, port, ssl=ssl_context), timeout)
+    try:
+        request = 'POST {0}?{1} HTTP/1.1\r\n' \
+                  'Host: {2}\r\n' \
+                  'Authorization: {3}\r\n' \
+                  'Content-Type: application/x-www-form-urlencoded\r\n' \
+                  'Content-Length: {4}\r\n' \
+                  'Connection: close\r\n\r\n'.format(parts.path, urlencode(query_params), parts.netloc, authorization, len(body))
+        stream_writer.write(request.encode('utf-8') + body)
+        await stream_writer.drain()
+
+        status_line = await asyncio.wait_for(reader.readline(), timeout)
+        status = status_line.decode('latin-1').rstrip('\r\n').split(' ', 2)
+        if len(status) < 2 or not status[1].isdigit():
+            raise ConnectionError('Unexpected status line {0!r}'.format(status_line))
+        headers = {}
+        while True:
+            header_line = await asyncio.wait_for(reader.readline(), timeout)
+            if header_line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = header_line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if int(status[1]) != 200:
+            raise StreamError(int(status[1]), status[2] if len(status) > 2 else '')
+        if policy is not None:
+            policy.on_connect()
+
+        response_body = ResponseBody(reader, headers.get('transfer-encoding', '').lower() == 'chunked', timeout=timeout)
+        watchdog = asyncio.ensure_future(response_body.watch(stream_writer))
+        try:
+            while True:
+                line = (await response_body.read_line()).strip()
+                if not line:
+                    # keep-alive newline
+                    continue
+                if not line.isdigit():
+                    raise ConnectionError('Expecting length, unexpected value {0!r} found'.format(line[:100]))
+                writer.write((await response_body.read_len(int(line))).decode('utf-8'))
+        finally:
+            watchdog.cancel()
+    finally:
+        stream_writer.close()
+
+
+async def start_streaming(crawler_conf):
+    """Stream one crawler into its hourly files, reconnecting with the backoff of a ReconnectPolicy whenever the connection fails."""
+    os.makedirs(crawler_conf['output_dir'], exist_ok=True)
+    writer = BatchWriter(crawler_conf['crawler_name'], crawler_conf['output_dir'], codec=crawler_conf['codec'],
+                         flush_interval=crawler_conf['flush_interval'], writer_process=crawler_conf['writer_process'],
+                         max_stall=crawler_conf['max_stall'])
+    policy = ReconnectPolicy()
+
+    try:
+        while True:
+            try:
+                await read_stream(crawler_conf, writer, url=crawler_conf['stream_url'], timeout=policy.stall_timeout, policy=policy)
+            except Exception as e:
+                wait = policy.on_disconnect(e.status_code if isinstance(e, StreamError) else None)
+                logging.error('Crawler {0} -- Disconnect cnt: {1}, msg: {2}, reconnect in {3:.2f}s, {4}'
+                              .format(crawler_conf['crawler_name'], policy.num_disconnect(), str(e), wait, policy.summary()))
+                await asyncio.sleep(wait)
+    finally:
+        writer.close()
+
+
+async def _gather_streaming(crawler_confs):
+    await asyncio.gather(*[start_streaming(crawler_conf) for crawler_conf in crawler_confs])
+
+
+def run_crawlers(crawler_confs):
+    """Stream all crawlers in crawler_confs from one event loop in the current process."""
+    asyncio.run(_gather_streaming(crawler_confs))
+
+
+if __name__ == '__main__':
+    with open('../conf/developer.key', 'r') as fin:
+        key_dict = json.load(fin)
+
+    conf_path = '../conf/covid_crawler.conf'
+    with open(conf_path, 'r') as config_file:
+        configs = json.load(config_file)
+    num_crawler = len([k for k in configs if k.startswith('crawler')])
+    codec_conf = load_codec_conf(conf_path)
+    # number of processes the crawlers are spread over, each runs one event loop for all of its crawlers
+    num_process = 1
+    # seconds between closing the current hourly file into complete compressed streams, for TweetExtractor.follow()
+    # None closes it once per hour
+    flush_interval = None
+    # compressing runs in the writer thread of each crawler, a writer process per crawler would undo the savings
+    writer_process = False
+    # seconds a crawler waits on a full writer queue before dropping the batch, None never drops
+    # the wait blocks the event loop, and so every crawler of the process
+    max_stall = 1
+
+    app_name = configs['app_name']
+    print('>>> app name: {0}'.format(app_name))
+    os.makedirs('../log', exist_ok=True)
+    logging.basicConfig(filename='../log/{0}_crawl.log'.format(app_name), filemode='w', format='%(asctime)s - %(message)s', level=logging.WARNING)
+
+    output_dir = '/data1/{0}'.format(app_name)
+    os.makedirs(output_dir, exist_ok=True)
+
+    crawler_confs = []
+    for i in range(num_crawler):
+        configs['crawler{0}'.format(i)]['output_dir'] = os.path.join(output_dir, configs['crawler{0}'.format(i)]['crawler_name'])
+        configs['crawler{0}'.format(i)]['key_token'] = key_dict[configs['crawler{0}'.format(i)]['key_set']]
+        configs['crawler{0}'.format(i)]['codec'] = codec_conf['crawl']
+        configs['crawler{0}'.format(i)]['flush_interval'] = flush_interval
+        configs['crawler{0}'.format(i)]['writer_process'] = writer_process
+        configs['crawler{0}'.format(i)]['max_stall'] = max_stall
+        configs['crawler{0}'.format(i)]['stream_url'] = stream_url
+        crawler_confs.append(configs['crawler{0}'.format(i)])
+
+    processes = []
+    for w in range(num_process):
+        p = Process(target=run_crawlers, args=(crawler_confs[w::num_process],))
+        p.daemon = not writer_process
+        p.start()
+        processes.append(p)
+
+    for p in processes:
+        p.join()
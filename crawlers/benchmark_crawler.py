@@ -0,0 +1,84 @@
+""" Benchmark the sustained tweets/sec a crawler writes before it falls behind the stream.
+For each rate, a mock stream in its own process (mock_stream_server.py) sends messages to one crawler connection
+of async_crawlers.py for a fixed duration, then disconnects it.
+The crawler keeps up if it is not disconnected for stalling, and has written all messages within max_lag seconds of the end.
+
+Usage: python benchmark_crawler.py
+Time: ~duration per rate
+"""
+
+import sys, os, time, shutil, asyncio, logging, tempfile
+from multiprocessing import Process, Queue
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
+from utils.codec import codec_open
+from utils.batch_writer import BatchWriter
+from crawlers.async_crawlers import read_stream
+from crawlers.mock_stream_server import run_server
+
+
+async def _crawl(crawler_conf, writer, url):
+    try:
+        await read_stream(crawler_conf, writer, url=url, timeout=90)
+    except (ConnectionError, TimeoutError) as e:
+        logging.info('Benchmark -- stream ended: {0}'.format(e))
+
+
+def benchmark_rate(rate, duration, codec='bz2', writer_process=False):
+    """Stream rate messages per second for duration seconds into a crawler,
+    return (statistics of the mock stream, seconds the crawler took to read and write all messages, number of messages written)."""
+    port_queue = Queue()
+    stats_queue = Queue()
+    server = Process(target=run_server, args=(port_queue,),
+                     kwargs={'rate': rate, 'disconnect_after': duration, 'stats_queue': stats_queue}, daemon=True)
+    server.start()
+    output_dir = tempfile.mkdtemp(prefix='benchmark_crawler_')
+    try:
+        url = 'http://127.0.0.1:{0}/1.1/statuses/filter.json'.format(port_queue.get())
+        crawler_conf = {'crawler_name': 'benchmark', 'keywords': ['covid'], 'languages': [],
+                        'key_token': {'consumer_key': 'key', 'consumer_secret': 'secret', 'access_token': 'token', 'access_secret': 'secret'}}
+        writer = BatchWriter('benchmark', output_dir, codec=codec, writer_process=writer_process)
+        start_ts = time.time()
+        asyncio.run(_crawl(crawler_conf, writer, url))
+        # batches still queued when the stream ends count as lag
+        writer.close()
+        elapsed_time = time.time() - start_ts
+        stats = stats_queue.get()
+
+        num_written = 0
+        for filename in os.listdir(output_dir):
+            with codec_open(os.path.join(output_dir, filename), 'rb') as fin:
+                num_written += sum(1 for _ in fin)
+        return stats, elapsed_time, num_written
+    finally:
+        server.terminate()
+        shutil.rmtree(output_dir)
+
+
+def main():
+    # messages per second sent to the crawler, in increasing order
+    rates = [1000, 2000, 5000, 10000, 20000, 50000]
+    duration = 10
+    codec = 'bz2'
+    writer_process = False
+    # seconds the crawler may lag behind the end of the stream
+    max_lag = 1
+
+    logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.WARNING)
+    sustained_rate = 0
+    for rate in rates:
+        stats, elapsed_time, num_written = benchmark_rate(rate, duration, codec=codec, writer_process=writer_process)
+        lag = elapsed_time - stats['duration']
+        kept_up = not stats['stalled'] and lag <= max_lag and num_written == stats['num_sent']
+        print('>>> rate {0: >6} msgs/sec: server sent {1: >9.0f} tweets/sec, crawler wrote {2: >9.0f} msgs/sec, '
+              'lag {3: >5.1f}s, server backlog max {4: >9} bytes, {5}'
+              .format(rate, stats['num_tweet'] / stats['duration'], num_written / elapsed_time, lag, stats['max_buffer'],
+                      'kept up' if kept_up else ('stalled' if stats['stalled'] else 'fell behind')))
+        if not kept_up:
+            break
+        sustained_rate = stats['num_tweet'] / stats['duration']
+    print('>>> sustained {0:.0f} tweets/sec with codec {1}{2}'.format(sustained_rate, codec, ', writer process' if writer_process else ''))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+""" Local HTTP server standing in for the filter endpoint of the streaming API.
+It streams synthesized tweets, retweets and quotes, or replays a raw hourly file, at a fixed rate per connection,
+with rate limit messages of growing track values and disconnect messages.
+Point a crawler at it through the stream_url of crawlers/async_crawlers.py, e.g. http://127.0.0.1:8080/1.1/statuses/filter.json.
+
+Usage: python mock_stream_server.py
+"""
+
+import sys, os, json, time, random, asyncio, logging
+from urllib.parse import urlsplit, parse_qs
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
+from utils.helper import make_snowflake
+from utils.codec import codec_open
+
+# https://developer.twitter.com/en/docs/twitter-api/v1/tweets/filter-realtime/guides/streaming-message-types
+disconnect_reasons = {1: 'Shutdown', 4: 'Stall'}
+
+
+def _user(rng):
+    return {'id_str': str(rng.randint(1, 10 ** 9)), 'location': rng.choice(['', 'Sydney, NSW', 'London']),
+            'followers_count': rng.randint(0, 10000), 'friends_count': rng.randint(0, 1000),
+            'statuses_count': rng.randint(0, 100000), 'favourites_count': rng.randint(0, 10000)}
+
+
+def _status(rng, i, id_str, created_at):
+    text = 'covid lockdown news {0} https://youtu.be/{1:011d}'.format(i, rng.randint(0, 10 ** 10))
+    return {'created_at': created_at, 'id_str': id_str, 'text': text, 'user': _user(rng),
+            'place': None if rng.random() < 0.9 else {'full_name': 'Sydney, NSW', 'country_code': 'AU'},
+            'filter_level': 'low', 'retweet_count': rng.randint(0, 100), 'favorite_count': rng.randint(0, 100),
+            'lang': rng.choice(['en', 'en', 'es', 'fr', 'und']),
+            'in_reply_to_status_id_str': None, 'in_reply_to_user_id_str': None,
+            'entities': {'urls': [{'expanded_url': 'https://youtu.be/{0:011d}'.format(rng.randint(0, 10 ** 10))}],
+                         'hashtags': [{'text': 'covid'}], 'user_mentions': [{'id_str': str(rng.randint(1, 10 ** 9))}]}}
+
+
+def synthesize_templates(num_template=1000, retweet_ratio=0.3, quote_ratio=0.1, seed=0):
+    """Return raw tweet lines with __ID__, __CREATED__ and __TS__ placeholders for the id, created_at and timestamp_ms
+    of the message, which are filled in when it is sent. Retweeted and quoted statuses keep fixed older ids."""
+    rng = random.Random(seed)
+    old_created_at = 'Mon Mar 23 00:00:00 +0000 2020'
+    templates = []
+    for i in range(num_template):
+        tweet = _status(rng, i, '__ID__', '__CREATED__')
+        if rng.random() < retweet_ratio:
+            tweet['retweeted_status'] = _status(rng, i, str(make_snowflake(1584921600000 + i, 1, 1, i)), old_created_at)
+            tweet['retweeted_status']['extended_tweet'] = {'full_text': 'long text {0}'.format(i),
+                                                           'entities': {'urls': [], 'hashtags': [{'text': 'pandemic'}], 'user_mentions': []}}
+        elif rng.random() < quote_ratio:
+            tweet['quoted_status'] = _status(rng, i, str(make_snowflake(1584921600000 + i, 2, 2, i)), old_created_at)
+        tweet['timestamp_ms'] = '__TS__'
+        templates.append(json.dumps(tweet))
+    return templates
+
+
+def replay_templates(replay_path):
+    """Return the non-empty lines of a raw hourly file, which are replayed as they are."""
+    with codec_open(replay_path, 'rt') as fin:
+        return [line.rstrip('\r\n') for line in fin if line.strip()]
+
+
+class MockStreamServer(object):
+    """ Serve every POST as a filter stream, in chunked transfer encoding, length delimited if the query asks for it.
+
+    :param rate: messages per second sent on each connection
+    :param templates: raw lines sent in a loop, see synthesize_templates() and replay_templates()
+    :param limit_interval: seconds between rate limit messages, None sends none
+    :param limit_ratio: ratio of undelivered to delivered tweets, by which track grows at each rate limit message
+    :param disconnect_after: seconds after which a connection is closed with a disconnect message, None keeps it open
+    :param max_buffer: bytes not yet taken by a client after which it is disconnected with a stall message, as Twitter does
+    :param status_code: HTTP status answered to every request, other than 200 to exercise the backoff of the crawlers
+    :param stats_queue: multiprocessing.Queue receiving a dict of statistics when a connection closes, None only logs them
+    """
+
+    def __init__(self, rate=1000, templates=None, limit_interval=1, limit_ratio=0.1, disconnect_after=None, max_buffer=16 * 1024 * 1024,
+                 status_code=200, stats_queue=None):
+        self.rate = rate
+        self.templates = templates if templates is not None else synthesize_templates()
+        self.limit_interval = limit_interval
+        self.limit_ratio = limit_ratio
+        self.disconnect_after = disconnect_after
+        self.max_buffer = max_buffer
+        self.status_code = status_code
+        self.stats_queue = stats_queue
+        self.tick = 0.01
+        self.keep_alive_interval = 30
+        self.num_connection = 0
+
+    async def serve(self, host='127.0.0.1', port=0):
+        """Start serving, return the asyncio server."""
+        return await asyncio.start_server(self._handle, host, port)
+
+    @staticmethod
+    def _format(template, connection_id, sequence_id, now_ms, created_at):
+        if '__ID__' not in template:
+            return template
+        return template.replace('__ID__', str(make_snowflake(now_ms, 0, connection_id, sequence_id))) \
+            .replace('__CREATED__', created_at).replace('__TS__', str(now_ms))
+
+    async def _handle(self, reader, writer):
+        self.num_connection += 1
+        connection_id = self.num_connection
+        try:
+            request_line = await reader.readline()
+            content_length = 0
+            while True:
+                header_line = await reader.readline()
+                if header_line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = header_line.decode('latin-1').partition(':')
+                if name.strip().lower() == 'content-length':
+                    content_length = int(value)
+            await reader.readexactly(content_length)
+            query = parse_qs(urlsplit(request_line.split(b' ')[1].decode('latin-1')).query)
+            delimited = query.get('delimited') == ['length']
+
+            if self.status_code != 200:
+                writer.write('HTTP/1.1 {0} Error\r\nContent-Length: 0\r\nConnection: close\r\n\r\n'.format(self.status_code).encode('ascii'))
+                await writer.drain()
+                return
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nTransfer-Encoding: chunked\r\n\r\n')
+            stats = await self._stream(writer, delimited, connection_id)
+            logging.warning('Mock stream -- connection {0} closed: {1}'.format(connection_id, stats))
+            if self.stats_queue is not None:
+                self.stats_queue.put(stats)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _stream(self, writer, delimited, connection_id):
+        start_ts = time.time()
+        last_write_ts = start_ts
+        next_limit_ts = start_ts + self.limit_interval if self.limit_interval is not None else None
+        num_sent = 0
+        num_tweet = 0
+        track = 0
+        max_buffer = 0
+        disconnect_code = None
+
+        while disconnect_code is None:
+            await asyncio.sleep(self.tick)
+            now = time.time()
+            now_ms = int(now * 1000)
+            created_at = time.strftime('%a %b %d %H:%M:%S +0000 %Y', time.gmtime(now))
+            lines = []
+            num_due = int((now - start_ts) * self.rate) - num_tweet
+            for _ in range(num_due):
+                lines.append(self._format(self.templates[num_tweet % len(self.templates)], connection_id, num_tweet, now_ms, created_at))
+                num_tweet += 1
+            if next_limit_ts is not None and now >= next_limit_ts:
+                track += int(self.rate * self.limit_interval * self.limit_ratio)
+                lines.append('{{"limit":{{"track":{0},"timestamp_ms":"{1}"}}}}'.format(track, now_ms))
+                next_limit_ts += self.limit_interval
+            buffer_size = writer.transport.get_write_buffer_size()
+            max_buffer = max(max_buffer, buffer_size)
+            if buffer_size > self.max_buffer:
+                disconnect_code = 4
+            elif self.disconnect_after is not None and now - start_ts >= self.disconnect_after:
+                disconnect_code = 1
+            if disconnect_code is not None:
+                lines.append(json.dumps({'disconnect': {'code': disconnect_code, 'stream_name': 'mock', 'reason': disconnect_reasons[disconnect_code]}}))
+
+            if len(lines) > 0:
+                payload = ''.join(self._frame(line, delimited) for line in lines).encode('utf-8')
+                last_write_ts = now
+            elif now - last_write_ts >= self.keep_alive_interval:
+                payload = b'\r\n'
+                last_write_ts = now
+            else:
+                continue
+            writer.write(b'%x\r\n' % len(payload) + payload + b'\r\n')
+            num_sent += len(lines)
+
+        writer.write(b'0\r\n\r\n')
+        await writer.drain()
+        return {'num_sent': num_sent, 'num_tweet': num_tweet, 'track': track, 'max_buffer': max_buffer,
+                'duration': time.time() - start_ts, 'stalled': disconnect_code == 4}
+
+    @staticmethod
+    def _frame(line, delimited):
+        message = line + '\r\n'
+        if delimited:
+            return '{0}\r\n{1}'.format(len(message.encode('utf-8')), message)
+        return message
+
+
+def run_server(port_queue=None, host='127.0.0.1', port=0, replay_path=None, **kwargs):
+    """Serve forever in the current process, put the port listened on into port_queue, or print its url if None.
+    Further keyword arguments are passed to MockStreamServer."""
+    async def _serve():
+        templates = replay_templates(replay_path) if replay_path is not None else None
+        server = await MockStreamServer(templates=templates, **kwargs).serve(host, port)
+        server_port = server.sockets[0].getsockname()[1]
+        if port_queue is not None:
+            port_queue.put(server_port)
+        else:
+            print('>>> mock stream at http://{0}:{1}/1.1/statuses/filter.json'.format(host, server_port))
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(_serve())
+
+
+if __name__ == '__main__':
+    host = '127.0.0.1'
+    port = 8080
+    # messages per second on each connection
+    rate = 1000
+    # raw hourly file to replay, e.g. '../data/covid/covid_all/2020-03-23-00.bz2', None synthesizes tweets
+    replay_path = None
+    # seconds after which connections are closed with a disconnect message, None keeps them open
+    disconnect_after = None
+    # HTTP status answered to every request, 420 to exercise the backoff of the crawlers
+    status_code = 200
+
+    logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.WARNING)
+    run_server(host=host, port=port, replay_path=replay_path, rate=rate, disconnect_after=disconnect_after,
+               status_code=status_code)
@@ -1,16 +1,38 @@
-import sys, os, bz2, json, time, logging
-from datetime import datetime
+import sys, os, json, time, queue, logging
 from tweepy import OAuthHandler
-from tweepy import Stream
 from tweepy.streaming import StreamListener
-from multiprocessing import Process, Queue
+from multiprocessing import Process, Queue, Event
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
+from utils.helper import list_suffixes
+from utils.codec import load_codec_conf
+from utils.batch_writer import BatchWriter
+from utils.reconnect import ReconnectPolicy
+from utils.policy_stream import PolicyStream
+
+
+class StreamStopped(Exception):
+    """Raised from a listener to end its stream on a stop request."""
 
 
 class StdOutListener(StreamListener):
     """ A listener handles tweets that are received from the stream.
     This is a basic listener that just prints received tweets to stdout.
+
+    Received messages are handed to a BatchWriter, so that encoding, compressing and hourly rotation
+    run in its writer thread, or its writer process, instead of the thread reading the stream.
+    With max_stall set, a batch that waits longer than max_stall seconds on the writer is dropped and counted.
+    With flush_interval set, the hourly file is closed and reopened in append mode every flush_interval seconds,
+    so that it ends with a complete compressed stream that TweetExtractor.follow() can read within that delay.
+    Connections, HTTP errors, timeouts and disconnect messages are reported to a ReconnectPolicy, and end the stream so that the caller backs off.
+    With status_queue set, (name, timestamp, number of messages, number of missing tweets) since the last report
+    is put into it every report_interval seconds, the missing tweets summed from the track of rate limit messages.
+    With stop_event set, the stream ends once the event is set.
+    The clock and the stop event are checked every check_every messages and at every keep-alive newline,
+    which Twitter sends on idle streams, instead of at every message.
     """
-    def __init__(self, name, output_dir):
+    def __init__(self, name, output_dir, codec='bz2', flush_interval=None, writer_process=False, max_stall=None,
+                 status_queue=None, stop_event=None, report_interval=60, check_every=100):
         StreamListener.__init__(self)
         self.name = name
         self.output_dir = output_dir
@@ -18,45 +40,303 @@ class StdOutListener(StreamListener):
         if not os.path.exists(output_dir):
             os.mkdir(output_dir)
 
-        current_dt = datetime.utcfromtimestamp(int(time.time())).strftime('%Y-%m-%d-%H')
-        self.output = bz2.open(os.path.join(self.output_dir, '{0}.bz2'.format(current_dt)), 'at')
-        self.next_hour_ts = (datetime.strptime(current_dt, '%Y-%m-%d-%H') - datetime(1970, 1, 1)).total_seconds() + 3600
+        self.writer = BatchWriter(name, output_dir, codec=codec, flush_interval=flush_interval,
+                                  writer_process=writer_process, max_stall=max_stall)
+        self.policy = ReconnectPolicy()
+        # HTTP status code that ended the last connection, None for network errors
+        self.status_code = None
+
+        self.status_queue = status_queue
+        self.stop_event = stop_event
+        self.report_interval = report_interval
+        self.next_report_ts = time.time() + report_interval
+        self.num_msg = 0
+        self.num_miss = 0
+        self.last_track = 0
+        self.check_every = check_every
+        self.num_unchecked = 0
 
     def on_data(self, data):
-        if time.time() >= self.next_hour_ts:
-            self.output.close()
-            current_dt = datetime.utcfromtimestamp(self.next_hour_ts).strftime('%Y-%m-%d-%H')
-            self.output = bz2.open(os.path.join(self.output_dir, '{0}.bz2'.format(current_dt)), 'at')
-            self.next_hour_ts += 3600
-        self.output.write(data)
+        self.writer.write(data)
+        if self.status_queue is not None:
+            self._count_status(data)
+        if data.startswith('{"disconnect"'):
+            return False
+        self.num_unchecked += 1
+        if self.num_unchecked >= self.check_every:
+            return self._check()
+
+    def keep_alive(self):
+        # tweepy ignores the return value of keep_alive, an exception ends the stream
+        if self._check() is False:
+            raise StreamStopped('stop requested')
+
+    def on_connect(self):
+        self.policy.on_connect()
+        # track counts the tweets missed since the connection started
+        self.last_track = 0
+
+    def on_error(self, status_code):
+        self.status_code = status_code
+        return False
+
+    def on_timeout(self):
+        return False
 
+    def _check(self):
+        self.num_unchecked = 0
+        if self.status_queue is not None:
+            self._report_status()
+        if self.stop_event is not None and self.stop_event.is_set():
+            return False
 
-def start_streaming(crawler_queue):
+    def _count_status(self, data):
+        if data.startswith('{"limit":'):
+            track = json.loads(data)['limit']['track']
+            self.num_miss += track - self.last_track if track > self.last_track else track
+            self.last_track = track
+        else:
+            self.num_msg += 1
+
+    def _report_status(self):
+        now = time.time()
+        if now >= self.next_report_ts:
+            self.status_queue.put((self.name, now, self.num_msg, self.num_miss))
+            self.num_msg = 0
+            self.num_miss = 0
+            self.next_report_ts = now + self.report_interval
+
+
+def start_streaming(crawler_queue, status_queue=None, stop_event=None):
     while not crawler_queue.empty():
         crawler_conf = crawler_queue.get()
 
-        listener = StdOutListener(name=crawler_conf['crawler_name'], output_dir=crawler_conf['output_dir'])
+        listener = StdOutListener(name=crawler_conf['crawler_name'], output_dir=crawler_conf['output_dir'], codec=crawler_conf['codec'],
+                                  flush_interval=crawler_conf['flush_interval'], writer_process=crawler_conf['writer_process'],
+                                  max_stall=crawler_conf['max_stall'], status_queue=status_queue, stop_event=stop_event)
         auth = OAuthHandler(crawler_conf['key_token']['consumer_key'], crawler_conf['key_token']['consumer_secret'])
         auth.set_access_token(crawler_conf['key_token']['access_token'], crawler_conf['key_token']['access_secret'])
-        disconnect_cnt = 0
+        policy = listener.policy
 
         while True:
+            listener.status_code = None
             try:
-                stream = Stream(auth, listener)
+                # no bytes, keep-alive newlines included, for stall_timeout seconds raises a timeout
+                stream = PolicyStream(auth, listener, timeout=policy.stall_timeout)
                 stream.filter(track=crawler_conf['keywords'], languages=crawler_conf['languages'])
+                msg = 'HTTP {0}'.format(listener.status_code) if listener.status_code is not None else 'stream closed or stalled'
             except Exception as e:
-                disconnect_cnt += 1
-                logging.error('Crawler {0} -- Disconnect cnt: {1}, msg: {2}'.format(crawler_conf['crawler_name'], disconnect_cnt, str(e)))
+                msg = str(e)
+            if stop_event is not None and stop_event.is_set():
+                break
+            wait = policy.on_disconnect(listener.status_code)
+            logging.error('Crawler {0} -- Disconnect cnt: {1}, msg: {2}, reconnect in {3:.2f}s, {4}'
+                          .format(crawler_conf['crawler_name'], policy.num_disconnect(), msg, wait, policy.summary()))
+            if stop_event is None:
+                time.sleep(wait)
+            elif stop_event.wait(wait):
+                # a stop request ends the backoff early
+                break
+        listener.writer.close()
+
+
+class RepartitionController(object):
+    """ Split rate limited subcrawlers onto spare keys and merge cold ones back, while crawling.
+
+    :param app_name: name of the app, prefix of the names of new subcrawlers
+    :param crawler_confs: list of crawler confs as prepared in main, with output_dir and key_token
+    :param key_dict: all developer keys, the ones not used by crawler_confs are spare
+    :param output_dir: directory of the hourly files of all subcrawlers
+    :param log_path: JSON lines file receiving the start of every subcrawler and every repartition
+    :param check_interval: seconds between decisions
+    :param split_ratio: ratio of missing tweets among all tweets of a subcrawler in a check interval, above which it is split
+    :param merge_ratio: fraction of the rate limit under which two subcrawlers split from the same one are merged back,
+                        the rate limit being the largest number of tweets a rate limited subcrawler received in a check interval
+    :param min_age: number of check intervals a subcrawler runs before it can be split or merged
+
+    A subcrawler is split into two by halving its languages, or its keywords if it tracks one or all languages,
+    each half taking a spare key. Only the two halves of a split are merged back, so that every subcrawler
+    tracks keywords x languages. The subcrawler tracking all keywords in all languages is never split,
+    it is the reference of the sampling rates. New subcrawlers continue the numbering of the conf
+    and of the subcrawler directories in output_dir, so that the extraction and merging stages handle them as any other subcrawler,
+    and the log attributes every subcrawler directory to its predicate and time window.
+    """
+
+    def __init__(self, app_name, crawler_confs, key_dict, output_dir, log_path, check_interval=300, split_ratio=0.01, merge_ratio=0.5, min_age=2):
+        self.key_dict = key_dict
+        self.output_dir = output_dir
+        self.log_path = log_path
+        self.check_interval = check_interval
+        self.split_ratio = split_ratio
+        self.merge_ratio = merge_ratio
+        self.min_age = min_age
+
+        self.initial_confs = crawler_confs
+        used_keys = {crawler_conf['key_set'] for crawler_conf in crawler_confs}
+        self.spare_keys = [key_set for key_set in key_dict if key_set not in used_keys]
+        self.app_name = app_name
+        # subcrawlers of an earlier run left directories beyond the conf, their suffixes are not reused
+        suffixes = [c['crawler_name'].rsplit('_', 1)[1] for c in crawler_confs]
+        if os.path.isdir(output_dir):
+            suffixes += list_suffixes(output_dir, app_name)
+        self.next_suffix = max([int(suffix) for suffix in suffixes if suffix.isdigit()] + [0]) + 1
+
+        self.status_queue = Queue()
+        # crawler name -> (crawler conf, process, stop event, number of check intervals run)
+        self.crawlers = {}
+        # processes asked to stop, with the key they release once exited
+        self.stopping = []
+        # crawler name -> [number of messages, number of missing tweets] in the current check interval
+        self.window = {}
+        # group id -> {'parent': conf split into the members, 'members': names of the two halves}
+        self.groups = {}
+        self.capacity = None
+
+    def run(self):
+        """Start the subcrawlers of the conf, then check them every check_interval seconds, forever."""
+        for crawler_conf in self.initial_confs:
+            self._start(crawler_conf)
+            self._log('start', [], [crawler_conf])
+        next_check_ts = time.time() + self.check_interval
+        while True:
+            timeout = max(next_check_ts - time.time(), 0)
+            try:
+                name, _, num_msg, num_miss = self.status_queue.get(timeout=min(timeout, 1))
+                if name in self.window:
+                    self.window[name][0] += num_msg
+                    self.window[name][1] += num_miss
+            except queue.Empty:
+                pass
+            self._reap()
+            if time.time() >= next_check_ts:
+                self._check()
+                next_check_ts = time.time() + self.check_interval
+
+    def _start(self, crawler_conf):
+        crawler_queue = Queue()
+        crawler_queue.put(crawler_conf)
+        stop_event = Event()
+        p = Process(target=start_streaming, args=(crawler_queue, self.status_queue, stop_event))
+        # daemonic processes cannot start the writer process
+        p.daemon = not crawler_conf['writer_process']
+        p.start()
+        self.crawlers[crawler_conf['crawler_name']] = (crawler_conf, p, stop_event, 0)
+        self.window[crawler_conf['crawler_name']] = [0, 0]
+
+    def _stop(self, name):
+        crawler_conf, p, stop_event, _ = self.crawlers.pop(name)
+        del self.window[name]
+        stop_event.set()
+        self.stopping.append((p, crawler_conf['key_set']))
+        return crawler_conf
+
+    def _reap(self):
+        # a key holds one connection, it is only reused once its process has exited
+        for p, key_set in list(self.stopping):
+            if not p.is_alive():
+                p.join()
+                self.spare_keys.append(key_set)
+                self.stopping.remove((p, key_set))
+
+    def _new_conf(self, crawler_conf, keywords, languages):
+        new_conf = dict(crawler_conf)
+        new_conf['crawler_name'] = '{0}_{1}'.format(self.app_name, self.next_suffix)
+        self.next_suffix += 1
+        new_conf['output_dir'] = os.path.join(self.output_dir, new_conf['crawler_name'])
+        new_conf['key_set'] = self.spare_keys.pop(0)
+        new_conf['key_token'] = self.key_dict[new_conf['key_set']]
+        new_conf['keywords'] = keywords
+        new_conf['languages'] = languages
+        return new_conf
+
+    def _check(self):
+        windows = {name: tuple(window) for name, window in self.window.items()}
+        for name in list(self.crawlers):
+            crawler_conf, p, stop_event, age = self.crawlers[name]
+            self.crawlers[name] = (crawler_conf, p, stop_event, age + 1)
+            self.window[name] = [0, 0]
+
+        for name, (num_msg, num_miss) in windows.items():
+            if num_miss > 0 and num_msg + num_miss > 0 and num_miss / (num_msg + num_miss) > self.split_ratio:
+                self.capacity = max(self.capacity or 0, num_msg)
+                crawler_conf, _, _, age = self.crawlers[name]
+                if name.endswith('_all') or age < self.min_age or len(self.spare_keys) < 2:
+                    continue
+                if len(crawler_conf['languages']) > 1:
+                    half = len(crawler_conf['languages']) // 2
+                    predicates = [(crawler_conf['keywords'], crawler_conf['languages'][:half]),
+                                  (crawler_conf['keywords'], crawler_conf['languages'][half:])]
+                elif len(crawler_conf['keywords']) > 1:
+                    half = len(crawler_conf['keywords']) // 2
+                    predicates = [(crawler_conf['keywords'][:half], crawler_conf['languages']),
+                                  (crawler_conf['keywords'][half:], crawler_conf['languages'])]
+                else:
+                    continue
+                self._stop(name)
+                new_confs = [self._new_conf(crawler_conf, keywords, languages) for keywords, languages in predicates]
+                group_id = len(self.groups)
+                while group_id in self.groups:
+                    group_id += 1
+                self.groups[group_id] = {'parent': crawler_conf, 'members': [c['crawler_name'] for c in new_confs]}
+                for new_conf in new_confs:
+                    new_conf['group'] = group_id
+                    self._start(new_conf)
+                self._log('split', [crawler_conf], new_confs, num_msg=num_msg, num_miss=num_miss)
+
+        if self.capacity is None:
+            return
+        for group_id, group in list(self.groups.items()):
+            members = group['members']
+            if not all(name in self.crawlers and name in windows and self.crawlers[name][3] >= self.min_age for name in members):
                 continue
+            if any(windows[name][1] > 0 for name in members):
+                continue
+            num_msg = sum(windows[name][0] for name in members)
+            if num_msg >= self.merge_ratio * self.capacity or len(self.spare_keys) < 1:
+                continue
+            member_confs = [self._stop(name) for name in members]
+            parent_conf = group['parent']
+            new_conf = self._new_conf(parent_conf, parent_conf['keywords'], parent_conf['languages'])
+            # the merged subcrawler replaces its parent as a member of the parent's own split
+            if parent_conf.get('group') in self.groups:
+                parent_members = self.groups[parent_conf['group']]['members']
+                parent_members[parent_members.index(parent_conf['crawler_name'])] = new_conf['crawler_name']
+            del self.groups[group_id]
+            self._start(new_conf)
+            self._log('merge', member_confs, [new_conf], num_msg=num_msg, num_miss=0)
+
+    def _log(self, action, from_confs, to_confs, **counts):
+        record = {'timestamp_ms': str(int(time.time() * 1000)), 'action': action,
+                  'from': [{k: c[k] for k in ['crawler_name', 'key_set', 'keywords', 'languages']} for c in from_confs],
+                  'to': [{k: c[k] for k in ['crawler_name', 'key_set', 'keywords', 'languages']} for c in to_confs]}
+        record.update(counts)
+        with open(self.log_path, 'a') as fout:
+            fout.write(json.dumps(record, ensure_ascii=False) + '\n')
+        if action != 'start':
+            logging.warning('Repartition -- {0} {1} into {2}'.format(action, [c['crawler_name'] for c in from_confs],
+                                                                   [c['crawler_name'] for c in to_confs]))
 
 
 if __name__ == '__main__':
     with open('../conf/developer.key', 'r') as fin:
         key_dict = json.load(fin)
 
-    with open('../conf/covid_crawler.conf', 'r') as config_file:
+    conf_path = '../conf/covid_crawler.conf'
+    with open(conf_path, 'r') as config_file:
         configs = json.load(config_file)
-    num_crawler = len(configs) - 1
+    num_crawler = len([k for k in configs if k.startswith('crawler')])
+    codec_conf = load_codec_conf(conf_path)
+    # seconds between closing the current hourly file into complete compressed streams, for TweetExtractor.follow()
+    # None closes it once per hour
+    flush_interval = None
+    # compress and write in a separate process per crawler, so that a slow disk does not stall the stream
+    writer_process = True
+    # seconds the stream waits on a full writer queue before dropping the batch, None never drops
+    # Twitter disconnects consumers that fall too far behind, which loses more than the dropped batch
+    max_stall = 10
+    # split rate limited subcrawlers onto the spare keys of developer.key and merge cold ones back while crawling,
+    # every change is logged into ../log/[app_name]_repartition.jsonl
+    adaptive = False
 
     app_name = configs['app_name']
     print('>>> app name: {0}'.format(app_name))
@@ -72,11 +352,21 @@ if __name__ == '__main__':
     for i in range(num_crawler):
         configs['crawler{0}'.format(i)]['output_dir'] = os.path.join(output_dir, configs['crawler{0}'.format(i)]['crawler_name'])
         configs['crawler{0}'.format(i)]['key_token'] = key_dict[configs['crawler{0}'.format(i)]['key_set']]
+        configs['crawler{0}'.format(i)]['codec'] = codec_conf['crawl']
+        configs['crawler{0}'.format(i)]['flush_interval'] = flush_interval
+        configs['crawler{0}'.format(i)]['writer_process'] = writer_process
+        configs['crawler{0}'.format(i)]['max_stall'] = max_stall
         crawler_queue.put(configs['crawler{0}'.format(i)])
 
+    if adaptive:
+        controller = RepartitionController(app_name, [configs['crawler{0}'.format(i)] for i in range(num_crawler)], key_dict, output_dir,
+                                           '../log/{0}_repartition.jsonl'.format(app_name))
+        controller.run()
+
     for w in range(num_crawler):
         p = Process(target=start_streaming, args=(crawler_queue,))
-        p.daemon = True
+        # daemonic processes cannot start the writer process
+        p.daemon = not writer_process
         p.start()
         processes.append(p)
 
@@ -1,14 +1,18 @@
 import sys, os, bz2, json, time, logging
 from datetime import datetime
 from tweepy import OAuthHandler
-from tweepy import Stream
 from tweepy.streaming import StreamListener
 from multiprocessing import Process, Queue
 
+sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
+from utils.reconnect import ReconnectPolicy
+from utils.policy_stream import PolicyStream
+
 
 class StdOutListener(StreamListener):
     """ A listener handles tweets that are received from the stream.
     This is a basic listener that just prints received tweets to stdout.
+    Errors and disconnect messages end the PolicyStream, the reconnect loop of main() then waits as self.policy says.
     """
     def __init__(self, name, output_dir):
         StreamListener.__init__(self)
@@ -21,6 +25,9 @@ class StdOutListener(StreamListener):
         current_dt = datetime.utcfromtimestamp(int(time.time())).strftime('%Y-%m-%d')
         self.output = bz2.open(os.path.join(self.output_dir, '{0}.bz2'.format(current_dt)), 'at')
         self.next_day_ts = (datetime.strptime(current_dt, '%Y-%m-%d') - datetime(1970, 1, 1)).total_seconds() + 3600 * 24
+        self.policy = ReconnectPolicy()
+        # HTTP status code that ended the last connection, None for network errors
+        self.status_code = None
 
     def on_data(self, data):
         if time.time() >= self.next_day_ts:
@@ -29,6 +36,18 @@ class StdOutListener(StreamListener):
             self.output = bz2.open(os.path.join(self.output_dir, '{0}.bz2'.format(current_dt)), 'at')
             self.next_day_ts += 3600 * 24
         self.output.write(data)
+        if data.startswith('{"disconnect"'):
+            return False
+
+    def on_connect(self):
+        self.policy.on_connect()
+
+    def on_error(self, status_code):
+        self.status_code = status_code
+        return False
+
+    def on_timeout(self):
+        return False
 
 
 if __name__ == '__main__':
@@ -64,13 +83,18 @@ if __name__ == '__main__':
     listener = StdOutListener(name=crawler_conf['crawler_name'], output_dir=crawler_conf['output_dir'])
     auth = OAuthHandler(crawler_conf['key_token']['consumer_key'], crawler_conf['key_token']['consumer_secret'])
     auth.set_access_token(crawler_conf['key_token']['access_token'], crawler_conf['key_token']['access_secret'])
-    disconnect_cnt = 0
+    policy = listener.policy
 
     while True:
+        listener.status_code = None
         try:
-            stream = Stream(auth, listener)
+            # no bytes, keep-alive newlines included, for stall_timeout seconds raises a timeout
+            stream = PolicyStream(auth, listener, timeout=policy.stall_timeout)
             stream.filter(track=crawler_conf['keywords'], languages=crawler_conf['languages'])
+            msg = 'HTTP {0}'.format(listener.status_code) if listener.status_code is not None else 'stream closed or stalled'
         except Exception as e:
-            disconnect_cnt += 1
-            logging.error('Crawler {0} -- Disconnect cnt: {1}, msg: {2}'.format(crawler_conf['crawler_name'], disconnect_cnt, str(e)))
-            continue
+            msg = str(e)
+        wait = policy.on_disconnect(listener.status_code)
+        logging.error('Crawler {0} -- Disconnect cnt: {1}, msg: {2}, reconnect in {3:.2f}s, {4}'
+                      .format(crawler_conf['crawler_name'], policy.num_disconnect(), msg, wait, policy.summary()))
+        time.sleep(wait)
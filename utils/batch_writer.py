@@ -0,0 +1,205 @@
+import os, json, time, queue, logging, threading
+import multiprocessing as mp
+from datetime import datetime
+
+from utils.codec import codec_open, codec_path
+
+
+class HourlyFileWriter(object):
+    """ Append text into hourly files named by the UTC hour of writing.
+
+    :param output_dir: directory of the hourly files
+    :param codec: codec of the hourly files
+    :param flush_interval: seconds between closing the current hourly file into a complete compressed stream,
+                           for TweetExtractor.follow(), None closes it once per hour
+    """
+
+    def __init__(self, output_dir, codec='bz2', flush_interval=None):
+        self.output_dir = output_dir
+        self.codec = codec
+        self.flush_interval = flush_interval
+        self.output = None
+        self.current_dt = None
+        self.next_flush_ts = None
+
+    def write(self, text):
+        now = time.time()
+        current_dt = datetime.utcfromtimestamp(int(now)).strftime('%Y-%m-%d-%H')
+        if current_dt != self.current_dt or (self.flush_interval is not None and now >= self.next_flush_ts):
+            if self.output is not None:
+                self.output.close()
+            self.current_dt = current_dt
+            self.output = codec_open(codec_path(os.path.join(self.output_dir, current_dt), self.codec), 'at', codec=self.codec)
+            if self.flush_interval is not None:
+                self.next_flush_ts = now + self.flush_interval
+        self.output.write(text)
+
+    def close(self):
+        if self.output is not None:
+            self.output.close()
+            self.output = None
+
+
+def _write_process(text_queue, output_dir, codec, flush_interval):
+    """Write the texts of text_queue into hourly files until None is received."""
+    output = HourlyFileWriter(output_dir, codec, flush_interval)
+    while True:
+        text = text_queue.get()
+        if text is None:
+            output.close()
+            return
+        output.write(text)
+
+
+class BatchWriter(object):
+    """ Write stream messages into hourly files from a background thread, in batches.
+
+    :param name: name of the crawler, used in log messages
+    :param output_dir: directory of the hourly files
+    :param codec: codec of the hourly files
+    :param batch_size: number of characters buffered before a batch is queued for writing
+    :param max_delay: seconds after which a partially filled batch is written anyway
+    :param max_batches: maximal number of queued batches
+    :param flush_interval: seconds between closing the current hourly file into a complete compressed stream,
+                           for TweetExtractor.follow(), None closes it once per hour
+    :param report_interval: seconds between reports of the queue depth, stalls and drops
+    :param writer_process: compress and write in a separate process fed by the writer thread, so that a slow disk
+                           or a busy core does not hold the interpreter reading the stream
+    :param max_stall: seconds write() waits on a full queue before dropping the batch, None waits as long as needed
+
+    write() only appends to the current batch, encoding, compressing and hourly rotation run in the writer thread,
+    or in the writer process. Messages go to the hourly file of the time their batch is written, at most max_delay seconds late.
+    A write() waiting on a full queue counts as a stall. A dropped batch is replaced by a
+    {"drop":{"messages":..,"characters":..,"timestamp_ms":".."}} line in the hourly file, so that the sampling loss
+    caused by the crawler can be told apart from the rate limit messages of Twitter.
+    """
+
+    def __init__(self, name, output_dir, codec='bz2', batch_size=1024 * 1024, max_delay=1, max_batches=64,
+                 flush_interval=None, report_interval=60, writer_process=False, max_stall=None):
+        self.name = name
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.report_interval = report_interval
+        self.max_stall = max_stall
+
+        self.lock = threading.Lock()
+        self.batch = []
+        self.batch_len = 0
+        self.queue = queue.Queue(maxsize=max_batches)
+        self.max_depth = 0
+        self.num_batch = 0
+        self.num_char = 0
+        self.num_stall = 0
+        self.stall_time = 0
+        self.num_drop_msg = 0
+        self.num_drop_char = 0
+        self.reported_stall = 0
+
+        if writer_process:
+            self.output = None
+            self.text_queue = mp.Queue(maxsize=max_batches)
+            self.process = mp.Process(target=_write_process, args=(self.text_queue, output_dir, codec, flush_interval),
+                                      name='{0}-writer'.format(name), daemon=True)
+            self.process.start()
+        else:
+            self.output = HourlyFileWriter(output_dir, codec, flush_interval)
+            self.process = None
+        self.thread = threading.Thread(target=self._run, name='{0}-writer'.format(name), daemon=True)
+        self.thread.start()
+
+    def write(self, data):
+        """Append a message to the current batch, queue the batch once it is full."""
+        with self.lock:
+            self.batch.append(data)
+            self.batch_len += len(data)
+            if self.batch_len >= self.batch_size:
+                # queued under the lock, so that a partial batch taken by the writer thread cannot overtake it
+                self._put_batch(self._take_batch())
+
+    def queue_depth(self):
+        """Return the number of full batches waiting for the writer thread."""
+        return self.queue.qsize()
+
+    def close(self):
+        """Write the remaining messages and close the current hourly file."""
+        self.queue.put(None)
+        self.thread.join()
+        self._report()
+
+    def _take_batch(self):
+        batch = self.batch
+        self.batch = []
+        self.batch_len = 0
+        return batch
+
+    def _put_batch(self, batch):
+        try:
+            self.queue.put_nowait(batch)
+            return
+        except queue.Full:
+            pass
+        stall_start = time.time()
+        self.num_stall += 1
+        try:
+            self.queue.put(batch, timeout=self.max_stall)
+        except queue.Full:
+            num_drop_char = sum(len(data) for data in batch)
+            self.num_drop_msg += len(batch)
+            self.num_drop_char += num_drop_char
+            drop = {'drop': {'messages': len(batch), 'characters': num_drop_char, 'timestamp_ms': str(int(time.time() * 1000))}}
+            self.batch.append(json.dumps(drop, separators=(',', ':')) + '\r\n')
+        self.stall_time += time.time() - stall_start
+
+    def _write_batch(self, batch):
+        text = ''.join(batch)
+        if self.process is None:
+            self.output.write(text)
+        else:
+            self.text_queue.put(text)
+        self.num_batch += 1
+        self.num_char += len(text)
+
+    def _report(self):
+        msg = 'Crawler {0} -- writer queue depth: max {1}/{2}, {3} batches, {4} characters written, ' \
+              '{5} stalls for {6:.1f}s, {7} messages of {8} characters dropped' \
+            .format(self.name, self.max_depth, self.queue.maxsize, self.num_batch, self.num_char,
+                    self.num_stall, self.stall_time, self.num_drop_msg, self.num_drop_char)
+        if self.max_depth >= self.queue.maxsize // 2 or self.num_stall > self.reported_stall:
+            logging.warning(msg)
+        else:
+            logging.info(msg)
+        self.max_depth = 0
+        self.reported_stall = self.num_stall
+
+    def _close_output(self):
+        if self.process is None:
+            self.output.close()
+        else:
+            self.text_queue.put(None)
+            self.process.join()
+
+    def _run(self):
+        next_report_ts = time.time() + self.report_interval
+        while True:
+            self.max_depth = max(self.max_depth, self.queue.qsize())
+            try:
+                batch = self.queue.get(timeout=self.max_delay)
+            except queue.Empty:
+                # the lock is held by write() while it waits on a full queue
+                batch = []
+                if self.lock.acquire(blocking=False):
+                    if self.queue.empty():
+                        batch = self._take_batch()
+                    self.lock.release()
+            if batch is None:
+                with self.lock:
+                    batch = self._take_batch()
+                if len(batch) > 0:
+                    self._write_batch(batch)
+                self._close_output()
+                return
+            if len(batch) > 0:
+                self._write_batch(batch)
+            if time.time() >= next_report_ts:
+                self._report()
+                next_report_ts = time.time() + self.report_interval
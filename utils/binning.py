@@ -0,0 +1,116 @@
+import numpy as np
+
+from utils.codec import codec_open
+
+# width of each binning resolution, in milliseconds
+resolution_ms = {'minute': 60 * 1000,
+                 'hour': 3600 * 1000,
+                 'day': 24 * 3600 * 1000}
+
+
+def _parse_chunk(lines):
+    tweet_lines = []
+    ratemsg_lines = []
+    for line in lines:
+        if b'ratemsg' in line:
+            ratemsg_lines.append(line.rstrip().split(b','))
+        elif b',' in line:
+            tweet_lines.append(line.rstrip().split(b','))
+    # fixed-width byte strings are converted to integers in one vectorized pass
+    tweet_ts = np.array([x[0] for x in tweet_lines], dtype=bytes).astype(np.int64)
+    tweet_ids = np.array([x[1] for x in tweet_lines], dtype=bytes).astype(np.uint64)
+    ratemsg_ts = np.array([x[0] for x in ratemsg_lines], dtype=bytes).astype(np.int64)
+    ratemsg_tracks = np.array([x[2] for x in ratemsg_lines], dtype=bytes).astype(np.int64)
+    return tweet_ts, tweet_ids, ratemsg_ts, ratemsg_tracks
+
+
+def load_ts_columns(ts_path, chunk_size=64 * 1024 * 1024):
+    """Load a ts file of the merging stage into numpy arrays, chunk_size bytes of lines at a time.
+    :return: (tweet timestamps in ms, tweet ids, rate limit message timestamps in ms, rate limit message tracks), in file order"""
+    chunks = []
+    with codec_open(ts_path, 'rb') as fin:
+        while True:
+            lines = fin.readlines(chunk_size)
+            if len(lines) == 0:
+                break
+            chunks.append(_parse_chunk(lines))
+    if len(chunks) == 0:
+        chunks.append(_parse_chunk([]))
+    return tuple(np.concatenate(columns) for columns in zip(*chunks))
+
+
+def bin_edges(start_ms, end_ms, resolution='hour'):
+    """Return the edges of equal bins from start_ms covering end_ms, the last edge is exclusive.
+    :param resolution: 'minute', 'hour', 'day', or a bin width in ms"""
+    width = resolution_ms.get(resolution, resolution)
+    num_bin = max((end_ms - start_ms) // width + 1, 1)
+    return start_ms + width * np.arange(num_bin + 1, dtype=np.int64)
+
+
+def bin_index(ts, edges):
+    """Return the bin of each timestamp, -1 for timestamps outside the edges."""
+    idx = np.searchsorted(edges, ts, side='right') - 1
+    idx[idx >= len(edges) - 1] = -1
+    return idx
+
+
+def bin_counts(ts, edges):
+    """Count the timestamps in each bin. Bins without timestamps count 0."""
+    idx = bin_index(ts, edges)
+    return np.bincount(idx[idx >= 0], minlength=len(edges) - 1)
+
+
+def track_increments(tracks, groups=None, start_with_rate=False):
+    """Return the number of missing tweets each rate limit message adds, the vectorized form of count_track() in utils/helper.py.
+    Track counts the tweets missed since the connection started, a value not above the previous one is a new connection,
+    which adds its whole track.
+    :param tracks: tracks in the order received within each group
+    :param groups: subcrawler index of each track, groups may interleave, None for a single subcrawler
+    :param start_with_rate: the first track of each group is only the baseline and adds nothing"""
+    tracks = np.asarray(tracks, dtype=np.int64)
+    if groups is None:
+        order = None
+        groups = np.zeros(len(tracks), dtype=np.int64)
+    else:
+        # a stable sort keeps the received order within each group
+        order = np.argsort(groups, kind='stable')
+        tracks = tracks[order]
+        groups = np.asarray(groups)[order]
+    increments = tracks.copy()
+    if len(tracks) > 0:
+        diffs = np.diff(tracks)
+        growing = (diffs > 0) & (groups[1:] == groups[:-1])
+        increments[1:][growing] = diffs[growing]
+        if start_with_rate:
+            increments[np.flatnonzero(np.diff(groups) != 0) + 1] = 0
+            increments[0] = 0
+    if order is None:
+        return increments
+    unsorted_increments = np.empty_like(increments)
+    unsorted_increments[order] = increments
+    return unsorted_increments
+
+
+def count_track_array(tracks, groups=None, ts=None, edges=None, num_group=None, start_with_rate=False):
+    """Count the missing tweets indicated by rate limit messages per subcrawler and per bin in one pass.
+    A rate limit message attributes its missing tweets to the bin of its timestamp.
+    :param groups: subcrawler index of each track, None for a single subcrawler
+    :param ts: timestamp of each track, only needed with edges
+    :param edges: bin edges from bin_edges(), None counts all tracks in one bin
+    :param num_group: number of subcrawlers, defaults to the largest index + 1
+    :return: numpy int64 array of shape (num_group, number of bins)"""
+    increments = track_increments(tracks, groups=groups, start_with_rate=start_with_rate)
+    if groups is None:
+        groups = np.zeros(len(increments), dtype=np.int64)
+    if num_group is None:
+        num_group = int(np.max(groups)) + 1 if len(groups) > 0 else 1
+    if edges is None:
+        num_bin = 1
+        idx = np.zeros(len(increments), dtype=np.int64)
+    else:
+        num_bin = len(edges) - 1
+        idx = bin_index(ts, edges)
+    mask = idx >= 0
+    flat_idx = np.asarray(groups, dtype=np.int64)[mask] * num_bin + idx[mask]
+    counts = np.bincount(flat_idx, weights=increments[mask], minlength=num_group * num_bin)
+    return np.rint(counts).astype(np.int64).reshape(num_group, num_bin)
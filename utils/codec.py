@@ -0,0 +1,144 @@
+import os, io, bz2, gzip, zlib, json
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+# file extension of each codec
+codec_ext = {'bz2': 'bz2',
+             'gzip': 'gz',
+             'zstd': 'zst',
+             'lz4': 'lz4',
+             'plain': 'txt'}
+ext_codec = {v: k for k, v in codec_ext.items()}
+
+codec_magic = {'bz2': b'BZh',
+               'gzip': b'\x1f\x8b',
+               'zstd': b'\x28\xb5\x2f\xfd',
+               'lz4': b'\x04\x22\x4d\x18'}
+
+# pipeline stages that write compressed files
+#   crawl:   hourly raw tweet files of StdOutListener
+#   extract: tweet_stats files of TweetExtractor
+#   merge:   ts_[app_name]_* and complete_ts_[app_name] files of merge_subcrawlers.py
+default_codec_conf = {'crawl': 'bz2', 'extract': 'bz2', 'merge': 'bz2'}
+
+
+def load_codec_conf(conf_path):
+    """Load the per-stage codecs from the optional "codec" entry of a crawler conf file."""
+    codec_conf = dict(default_codec_conf)
+    if os.path.exists(conf_path):
+        with open(conf_path, 'r') as fin:
+            codec_conf.update(json.load(fin).get('codec', {}))
+    for stage, codec in codec_conf.items():
+        if codec not in codec_ext:
+            raise ValueError('Unknown codec {0} for stage {1}, choose from {2}'.format(codec, stage, list(codec_ext)))
+    return codec_conf
+
+
+def codec_path(base_path, codec):
+    """Append the file extension of codec to base_path."""
+    return '{0}.{1}'.format(base_path, codec_ext[codec])
+
+
+def split_codec_path(filepath):
+    """Split filepath into (base path, codec), codec is None if the extension is not a known codec."""
+    base_path, ext = os.path.splitext(filepath)
+    return base_path, ext_codec.get(ext[1:])
+
+
+def find_codec_file(base_path):
+    """Return the existing file of base_path in any codec, None if there is none."""
+    for codec in codec_ext:
+        filepath = codec_path(base_path, codec)
+        if os.path.exists(filepath):
+            return filepath
+    return None
+
+
+def detect_codec(filepath):
+    """Detect the codec of filepath from its extension, then from its magic bytes."""
+    codec = split_codec_path(filepath)[1]
+    if codec is not None and codec != 'plain':
+        return codec
+    with open(filepath, 'rb') as fin:
+        head = fin.read(4)
+    for codec, magic in codec_magic.items():
+        if head.startswith(magic):
+            return codec
+    return 'plain'
+
+
+def _check_available(codec):
+    if codec == 'zstd' and zstandard is None:
+        raise ImportError('zstd codec requires the zstandard package')
+    if codec == 'lz4' and lz4 is None:
+        raise ImportError('lz4 codec requires the lz4 package')
+
+
+def codec_open(filepath, mode='rb', codec=None):
+    """Open a file in any codec, like bz2.open.
+
+    :param filepath: path of the file
+    :param mode: 'rb', 'rt', 'wb', 'wt', 'ab' or 'at'
+    :param codec: one of codec_ext, detected from the file when reading and from the extension when writing if None
+    """
+    if codec is None:
+        if 'r' in mode:
+            codec = detect_codec(filepath)
+        else:
+            codec = split_codec_path(filepath)[1] or 'plain'
+    _check_available(codec)
+    text_mode = 't' in mode
+    binary_mode = mode.replace('t', '').replace('b', '') + 'b'
+
+    if codec == 'bz2':
+        return bz2.open(filepath, mode)
+    elif codec == 'gzip':
+        return gzip.open(filepath, mode)
+    elif codec == 'lz4':
+        return lz4.frame.open(filepath, mode)
+    elif codec == 'zstd':
+        if 'r' in mode:
+            # appended files consist of several frames
+            fh = io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(filepath, 'rb'), read_across_frames=True, closefd=True))
+        else:
+            fh = zstandard.ZstdCompressor().stream_writer(open(filepath, binary_mode), closefd=True)
+        if text_mode:
+            return io.TextIOWrapper(fh, encoding='utf-8')
+        return fh
+    else:
+        if text_mode:
+            return open(filepath, mode, encoding='utf-8')
+        return open(filepath, binary_mode)
+
+
+class _PlainDecompressor(object):
+    """Pass plain data through, as a stream that never ends."""
+    eof = False
+    unused_data = b''
+
+    def decompress(self, data):
+        return data
+
+
+def codec_decompressor(codec):
+    """Return an incremental decompressor of one stream, frame or member in codec,
+    with decompress(), eof and unused_data like bz2.BZ2Decompressor."""
+    _check_available(codec)
+    if codec == 'bz2':
+        return bz2.BZ2Decompressor()
+    elif codec == 'gzip':
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif codec == 'zstd':
+        return zstandard.ZstdDecompressor().decompressobj()
+    elif codec == 'lz4':
+        return lz4.frame.LZ4FrameDecompressor()
+    else:
+        return _PlainDecompressor()
@@ -0,0 +1,45 @@
+import numpy as np
+
+
+class TweetIdSet(object):
+    """ Compact set of 64-bit tweet ids, used to remove duplicated tweets.
+
+    :param min_buffer: minimal number of ids held in the insertion buffer before merging
+    :param buffer_ratio: the insertion buffer is merged once it exceeds this ratio of the sorted array
+
+    Ids are kept in a sorted numpy uint64 array, costing 8 bytes per id instead of 70+ bytes for a str in a set.
+    New ids go into a small insertion buffer, which is merged into the sorted array in one vectorized pass.
+    """
+
+    def __init__(self, min_buffer=65536, buffer_ratio=1 / 32):
+        self.min_buffer = min_buffer
+        self.buffer_ratio = buffer_ratio
+
+        self.sorted_ids = np.empty(0, dtype=np.uint64)
+        self.buffer = set()
+
+    def __len__(self):
+        return len(self.sorted_ids) + len(self.buffer)
+
+    def __contains__(self, tid):
+        tid = int(tid)
+        if tid in self.buffer:
+            return True
+        idx = np.searchsorted(self.sorted_ids, np.uint64(tid))
+        return idx < len(self.sorted_ids) and int(self.sorted_ids[idx]) == tid
+
+    def add(self, tid):
+        tid = int(tid)
+        if tid in self:
+            return
+        self.buffer.add(tid)
+        if len(self.buffer) >= max(self.min_buffer, self.buffer_ratio * len(self.sorted_ids)):
+            self._merge_buffer()
+
+    def _merge_buffer(self):
+        buffer_ids = np.fromiter(self.buffer, dtype=np.uint64, count=len(self.buffer))
+        # two sorted runs, the stable sort merges them in linear time
+        merged_ids = np.concatenate([self.sorted_ids, np.sort(buffer_ids)])
+        merged_ids.sort(kind='stable')
+        self.sorted_ids = merged_ids
+        self.buffer = set()
@@ -0,0 +1,138 @@
+import os, shutil
+from operator import itemgetter
+
+from utils.helper import kway_merge
+
+
+def dedup_sorted(records, keep_last=None):
+    """Remove records with duplicated keys from (key, payload) records sorted by key, keeping the first one.
+    :param keep_last: function on payloads, a later record replaces the kept one when it holds for both payloads"""
+    kept = None
+    for key, payload in records:
+        if kept is None or key != kept[0]:
+            if kept is not None:
+                yield kept
+            kept = (key, payload)
+        elif keep_last is not None and keep_last(kept[1]) and keep_last(payload):
+            kept = (key, payload)
+    if kept is not None:
+        yield kept
+
+
+def write_run(run_path, records):
+    """Write (key, payload) records as a run file, one 'key,payload' line per record."""
+    with open(run_path, 'w') as fout:
+        for key, payload in records:
+            fout.write('{0},{1}\n'.format(key, payload))
+
+
+def write_sorted_run(run_path, records, keep_last=None):
+    """Sort (key, payload) records by key, remove duplicated keys as dedup_sorted() and write them as a run file."""
+    # stable sort, earlier records stay ahead of later records with the same key
+    records.sort(key=itemgetter(0))
+    write_run(run_path, dedup_sorted(records, keep_last=keep_last))
+
+
+def read_run(run_path):
+    """Yield (key, payload) records of a run file."""
+    with open(run_path, 'r') as fin:
+        for line in fin:
+            key, payload = line.rstrip('\n').split(',', 1)
+            yield int(key), payload
+
+
+class ExternalSorter(object):
+    """ Sort (key, payload) records with a bounded memory budget.
+
+    :param run_dir: directory to spill sorted runs, removed after sorting
+    :param mem_budget: approximate memory budget in MB for records held in memory
+    :param fan_in: maximal number of runs merged at once
+    :param keep_last: function on payloads, see dedup_sorted(), None keeps the first added record of each key
+
+    Records are buffered until the budget is reached, then sorted by key and spilled to disk as a run.
+    Runs are k-way merged afterwards, and records with duplicated keys are removed, keeping the first added one
+    unless keep_last holds for the kept and the later record.
+    Sorted runs written elsewhere, e.g. by TweetExtractor, can be merged along with add_runs().
+    Payloads must not contain newline characters.
+    """
+
+    # approximate bytes of an int key, a tuple and the list slot besides the payload characters
+    record_overhead = 150
+
+    def __init__(self, run_dir, mem_budget=1024, fan_in=128, keep_last=None):
+        self.run_dir = run_dir
+        self.mem_budget = mem_budget * 1024 * 1024
+        self.fan_in = fan_in
+        self.keep_last = keep_last
+
+        self.buffer = []
+        self.buffer_size = 0
+        self.run_paths = []
+        self.owned_runs = set()
+        self.num_run = 0
+
+    def add(self, key, payload):
+        self.buffer.append((key, payload))
+        self.buffer_size += self.record_overhead + len(payload)
+        if self.buffer_size >= self.mem_budget:
+            self._spill()
+
+    def add_runs(self, run_paths):
+        """Add sorted run files without duplicated keys, they are merged after the runs spilled so far and kept on disk.
+        Runs are added in collecting order, later runs win ties under keep_last."""
+        self.run_paths.extend(run_paths)
+
+    def _new_run_path(self):
+        os.makedirs(self.run_dir, exist_ok=True)
+        run_path = os.path.join(self.run_dir, 'run_{0}.txt'.format(self.num_run))
+        self.num_run += 1
+        self.owned_runs.add(run_path)
+        return run_path
+
+    def _spill(self):
+        run_path = self._new_run_path()
+        write_sorted_run(run_path, self.buffer, keep_last=self.keep_last)
+        self.run_paths.append(run_path)
+        self.buffer = []
+        self.buffer_size = 0
+
+    @staticmethod
+    def _merge_runs(run_paths):
+        for key, _, payload in kway_merge([read_run(run_path) for run_path in run_paths]):
+            yield key, payload
+
+    def sorted_unique(self):
+        """Yield all added records in ascending key order, without duplicated keys."""
+        if len(self.run_paths) == 0:
+            self.buffer.sort(key=itemgetter(0))
+            yield from dedup_sorted(self.buffer, keep_last=self.keep_last)
+            self.buffer = []
+            self.buffer_size = 0
+            return
+
+        if len(self.buffer) > 0:
+            self._spill()
+        # merge consecutive runs in passes, so that runs keep their order for ties
+        while len(self.run_paths) > self.fan_in:
+            merged_paths = []
+            for i in range(0, len(self.run_paths), self.fan_in):
+                group = self.run_paths[i: i + self.fan_in]
+                if len(group) == 1:
+                    merged_paths.append(group[0])
+                    continue
+                run_path = self._new_run_path()
+                write_run(run_path, dedup_sorted(self._merge_runs(group), keep_last=self.keep_last))
+                for merged_path in group:
+                    if merged_path in self.owned_runs:
+                        os.remove(merged_path)
+                merged_paths.append(run_path)
+            self.run_paths = merged_paths
+
+        yield from dedup_sorted(self._merge_runs(self.run_paths), keep_last=self.keep_last)
+        self.cleanup()
+
+    def cleanup(self):
+        """Remove spilled runs from disk."""
+        shutil.rmtree(self.run_dir, ignore_errors=True)
+        self.run_paths = []
+        self.owned_runs = set()
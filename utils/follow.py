@@ -0,0 +1,94 @@
+import os
+
+from utils.codec import codec_decompressor, detect_codec
+
+
+class FollowReader(object):
+    """ Read the complete lines appended to a compressed file that is still being written.
+
+    :param filepath: path of the file
+    :param stream_offset: byte offset in the file where the stream holding the next unread line starts
+    :param consumed: number of decompressed bytes of that stream already returned as lines
+
+    Files appended in 'at' mode consist of concatenated streams, one per opening.
+    Each stream is decompressed as soon as its bytes arrive, and the end of a stream ends a line.
+    (stream_offset, consumed) is a checkpoint to resume from, see checkpoint().
+    """
+
+    def __init__(self, filepath, stream_offset=0, consumed=0):
+        self.filepath = filepath
+        self.codec = None
+        self.decompressor = None
+        self.read_offset = stream_offset
+        self.stream_offset = stream_offset
+        self.consumed = consumed
+        # decompressed bytes of the current stream to drop when resuming from a checkpoint
+        self.skip = consumed
+        self.buffer = b''
+
+    def checkpoint(self):
+        """Return the position after the last returned line as a dict of stream_offset and consumed."""
+        return {'stream_offset': self.stream_offset, 'consumed': self.consumed}
+
+    def at_stream_end(self):
+        """Whether all bytes written so far form complete streams that have been returned."""
+        return self.read_offset == self.stream_offset and len(self.buffer) == 0
+
+    def at_file_end(self):
+        """Whether all bytes written so far have been read, whatever the codec."""
+        return self.read_offset == os.path.getsize(self.filepath)
+
+    def poll(self, chunk_size=16 * 1024 * 1024):
+        """Yield lists of the complete lines appended since the last poll, as bytes ending with newline, one list per chunk read."""
+        if self.codec is None:
+            if os.path.getsize(self.filepath) == 0:
+                return
+            self.codec = detect_codec(self.filepath)
+            self.decompressor = codec_decompressor(self.codec)
+
+        with open(self.filepath, 'rb') as fin:
+            fin.seek(self.read_offset)
+            while True:
+                data = fin.read(chunk_size)
+                if len(data) == 0:
+                    break
+                self.read_offset += len(data)
+
+                lines = []
+                while len(data) > 0:
+                    self._append(self.decompressor.decompress(data))
+                    if not self.decompressor.eof:
+                        break
+                    # a finished stream ends its last line, the following bytes start a new stream
+                    data = self.decompressor.unused_data or b''
+                    lines.extend(self._split_lines(end_of_stream=True))
+                    self.stream_offset = self.read_offset - len(data)
+                    self.consumed = 0
+                    self.decompressor = codec_decompressor(self.codec)
+                lines.extend(self._split_lines(end_of_stream=False))
+                if len(lines) > 0:
+                    yield lines
+
+    def _append(self, decompressed):
+        if self.skip > 0:
+            dropped = min(self.skip, len(decompressed))
+            decompressed = decompressed[dropped:]
+            self.skip -= dropped
+        self.buffer += decompressed
+
+    def _split_lines(self, end_of_stream):
+        if end_of_stream:
+            end = len(self.buffer)
+        else:
+            end = self.buffer.rfind(b'\n') + 1
+        if end == 0:
+            return []
+        lines = [line + b'\n' for line in self.buffer[:end].split(b'\n')]
+        # drop the empty piece after the last newline, or the newline appended to an unterminated last line
+        if lines[-1] == b'\n':
+            lines.pop()
+        else:
+            lines[-1] = lines[-1][:-1]
+        self.buffer = self.buffer[end:]
+        self.consumed += end
+        return lines
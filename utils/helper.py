@@ -1,5 +1,7 @@
-import time
+import os, time, heapq
+from functools import lru_cache
 from datetime import datetime, timedelta
+import numpy as np
 
 
 class Timer:
@@ -35,6 +37,26 @@ def obj2str(obj, fmt='youtube'):
         return obj.strftime(fmt)
 
 
+month_numbers = {'Jan': '01', 'Feb': '02', 'Mar': '03', 'Apr': '04', 'May': '05', 'Jun': '06',
+                 'Jul': '07', 'Aug': '08', 'Sep': '09', 'Oct': '10', 'Nov': '11', 'Dec': '12'}
+
+
+@lru_cache(maxsize=4096)
+def _tweet_date(created_at_prefix, year):
+    month = month_numbers.get(created_at_prefix[4:7])
+    day = created_at_prefix[8:10]
+    if month is None or not day.isdigit() or not year.isdigit():
+        raise ValueError('time data {0!r} does not match format {1!r}'.format(created_at_prefix, date_format['tweet']))
+    return '{0}-{1}-{2}'.format(year, month, day)
+
+
+def tweet_date(created_at):
+    """convert a tweet created_at, e.g. 'Mon Mar 23 00:02:00 +0000 2020', into a youtube date, e.g. '2020-03-23'.
+    the same as obj2str(str2obj(created_at, fmt='tweet')), the date is sliced as written without timezone conversion,
+    and cached on the day as created_at repeats heavily within an hour"""
+    return _tweet_date(created_at[:10], created_at[-4:])
+
+
 # twitter's snowflake parameters
 twepoch = 1288834974657
 datacenter_id_bits = 5
@@ -69,6 +91,68 @@ def melt_snowflake(snowflake_id, twepoch=twepoch):
     return timestamp_ms, datacenter_id, worker_id, sequence_id
 
 
+def make_snowflake_array(timestamps_ms, datacenter_ids, worker_ids, sequence_ids, twepoch=twepoch):
+    """vectorized make_snowflake() over numpy arrays, scalars are broadcast.
+    :return: numpy uint64 array of snowflake ids"""
+    timestamps_ms = np.asarray(timestamps_ms, dtype=np.int64)
+    sid = ((timestamps_ms - twepoch) % max_timestamp).astype(np.uint64) << np.uint64(datacenter_id_bits + worker_id_bits + sequence_id_bits)
+    sid |= (np.asarray(datacenter_ids, dtype=np.int64) % max_datacenter_id).astype(np.uint64) << np.uint64(worker_id_bits + sequence_id_bits)
+    sid |= (np.asarray(worker_ids, dtype=np.int64) % max_worker_id).astype(np.uint64) << np.uint64(sequence_id_bits)
+    sid |= (np.asarray(sequence_ids, dtype=np.int64) % max_sequence_id).astype(np.uint64)
+    return sid
+
+
+def snowflake_timestamp(snowflake_ids, twepoch=twepoch):
+    """extract the creation time in milliseconds since UNIX epoch from an array of snowflake ids, without the other components."""
+    snowflake_ids = np.asarray(snowflake_ids, dtype=np.uint64)
+    return (snowflake_ids >> np.uint64(datacenter_id_bits + worker_id_bits + sequence_id_bits)).astype(np.int64) + twepoch
+
+
+def melt_snowflake_array(snowflake_ids, twepoch=twepoch):
+    """vectorized melt_snowflake() over a numpy array of snowflake ids.
+    :return: (timestamps_ms, datacenter_ids, worker_ids, sequence_ids), numpy int64 arrays"""
+    snowflake_ids = np.asarray(snowflake_ids, dtype=np.uint64)
+    sequence_ids = (snowflake_ids & np.uint64(max_sequence_id - 1)).astype(np.int64)
+    worker_ids = ((snowflake_ids >> np.uint64(sequence_id_bits)) & np.uint64(max_worker_id - 1)).astype(np.int64)
+    datacenter_ids = ((snowflake_ids >> np.uint64(worker_id_bits + sequence_id_bits)) & np.uint64(max_datacenter_id - 1)).astype(np.int64)
+    return snowflake_timestamp(snowflake_ids, twepoch=twepoch), datacenter_ids, worker_ids, sequence_ids
+
+
+# rate limit messages are placed this many milliseconds ahead of their timestamp in the merged id order
+ratemsg_offset = 5000
+
+
+def make_ts_record(split_line, suffix, suffix_idx):
+    """turn a split timestamp line into a (snowflake id, ts line) record of the merged stream.
+    :param split_line: [timestamp_ms, tweet_id] for a tweet, or [timestamp_ms, ratemsg_suffix, track] for a rate limit message
+    :param suffix: suffix of the subcrawler
+    :param suffix_idx: index of the subcrawler, encoded into the snowflake id of rate limit messages"""
+    if len(split_line) == 3:
+        ratemsg_id = make_snowflake(int(split_line[0]) - ratemsg_offset, 31, 31, suffix_idx)
+        return ratemsg_id, '{0},ratemsg{1},{2}'.format(melt_snowflake(ratemsg_id)[0], suffix, split_line[2])
+    else:
+        return int(split_line[1]), '{0},{1}'.format(split_line[0], split_line[1])
+
+
+def is_ratemsg_line(ts_line):
+    """whether a ts line of the merged stream is a rate limit message, [timestamp_ms],ratemsg[suffix],[track].
+    rate limit messages of the same millisecond share a snowflake id, the last seen one is kept."""
+    return ts_line.count(',') == 2
+
+
+def sort_suffixes(suffixes):
+    """order subcrawler suffixes as the merging stage does, numeric suffixes ascending then the others, e.g. 'all'."""
+    return sorted(suffixes, key=lambda x: (0, int(x), '') if x.isdigit() else (1, 0, x))
+
+
+def list_suffixes(archive_dir, app_name):
+    """return the suffixes of the [app_name]_* subcrawler directories in archive_dir, ordered by sort_suffixes().
+    the index of a suffix in this list is its sequence id in the snowflake ids of rate limit messages."""
+    prefix = '{0}_'.format(app_name)
+    return sort_suffixes([name.split('_')[-1] for name in os.listdir(archive_dir)
+                          if name.startswith(prefix) and os.path.isdir(os.path.join(archive_dir, name))])
+
+
 def count_track(track_list, start_with_rate=False, subcrawler=False):
     if subcrawler:
         total_track_cnt = 0
@@ -94,6 +178,29 @@ def count_track(track_list, start_with_rate=False, subcrawler=False):
         return track_cnt
 
 
+def kway_merge(streams):
+    """merge k sorted streams in O(N log K) with a min-heap of (sort_key, source_index) entries.
+    :param streams: list of iterables, each yields (sort_key, item) tuples in ascending sort_key order
+    :return: generator of (sort_key, source_index, item), ties are broken by the source index"""
+    iterators = [iter(stream) for stream in streams]
+    heap = []
+    for source_idx, iterator in enumerate(iterators):
+        for sort_key, item in iterator:
+            heap.append((sort_key, source_idx, item))
+            break
+    heapq.heapify(heap)
+
+    while heap:
+        sort_key, source_idx, item = heap[0]
+        yield sort_key, source_idx, item
+        for next_key, next_item in iterators[source_idx]:
+            heapq.heapreplace(heap, (next_key, source_idx, next_item))
+            break
+        else:
+            # exhausted source drops out of the heap
+            heapq.heappop(heap)
+
+
 def concise_fmt(x, pos):
     if abs(x) // 10000000000 > 0:
         return '{0:.0f}B'.format(x / 1000000000)
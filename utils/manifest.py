@@ -0,0 +1,43 @@
+import os, json, zlib
+
+
+def file_crc32(filepath, size=None, chunk_size=1024 * 1024):
+    """Compute the crc32 of the first size bytes of a file, of the whole file if size is None."""
+    crc = 0
+    remaining = size
+    with open(filepath, 'rb') as fin:
+        while remaining is None or remaining > 0:
+            chunk = fin.read(chunk_size if remaining is None else min(chunk_size, remaining))
+            if not chunk:
+                break
+            crc = zlib.crc32(chunk, crc)
+            if remaining is not None:
+                remaining -= len(chunk)
+    return crc
+
+
+def load_manifest(manifest_path):
+    """Load a manifest as {input key: entry}, empty if it does not exist."""
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, 'r') as fin:
+        return json.load(fin)
+
+
+def save_manifest(manifest_path, manifest):
+    """Write a manifest into a temporary file, then atomically rename it over the previous one."""
+    tmp_path = '{0}.tmp'.format(manifest_path)
+    with open(tmp_path, 'w') as fout:
+        json.dump(manifest, fout, indent=1, sort_keys=True)
+        fout.flush()
+        os.fsync(fout.fileno())
+    os.replace(tmp_path, manifest_path)
+
+
+def is_unchanged(entry, filepath, size, mtime_ns):
+    """Whether a file still has the size, and the mtime or else the crc32, recorded in its manifest entry."""
+    if entry is None or entry['size'] != size:
+        return False
+    if entry['mtime_ns'] == mtime_ns:
+        return True
+    return entry['crc32'] == file_crc32(filepath, size)
@@ -0,0 +1,226 @@
+import bz2, io
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# bz2 block header and end-of-stream magic numbers, both 48 bits and not byte-aligned
+block_magic = 0x314159265359
+eos_magic = 0x177245385090
+magic_mask = (1 << 48) - 1
+
+
+def _magic_needles(magic):
+    """For each of the 8 bit shifts, the 5 bytes that are fully covered by the magic in a 7-byte frame."""
+    return [((magic << (8 - shift)).to_bytes(7, 'big')[1:6], shift) for shift in range(8)]
+
+
+block_needles = _magic_needles(block_magic)
+eos_needles = _magic_needles(eos_magic)
+
+
+def _find_magics(buf, start):
+    """Return sorted (bit position, is_block) of all magics whose 7-byte frame starts at or after byte start."""
+    found = []
+    for needles, is_block, magic in ((block_needles, True, block_magic), (eos_needles, False, eos_magic)):
+        for needle, shift in needles:
+            idx = buf.find(needle, start + 1)
+            while 0 <= idx and idx + 6 <= len(buf):
+                frame = int.from_bytes(buf[idx - 1: idx + 6], 'big')
+                if (frame >> (8 - shift)) & magic_mask == magic:
+                    found.append(((idx - 1) * 8 + shift, is_block))
+                idx = buf.find(needle, idx + 1)
+    return sorted(found)
+
+
+def _block_to_stream(block_bits, num_bits):
+    """Wrap the bits of one compressed block into a standalone single-block bz2 stream."""
+    block_crc = (block_bits >> (num_bits - 80)) & 0xffffffff
+    # the combined crc of a single-block stream equals its block crc
+    stream_bits = (((block_bits << 48) | eos_magic) << 32) | block_crc
+    num_bits += 80
+    padding = -num_bits % 8
+    return b'BZh9' + (stream_bits << padding).to_bytes((num_bits + padding) // 8, 'big')
+
+
+def _decompress_block(block_bits, num_bits):
+    return bz2.decompress(_block_to_stream(block_bits, num_bits))
+
+
+class ParallelBZ2Reader(object):
+    """ Block-parallel bz2 reader, iterates over lines in bytes like bz2.BZ2File.
+
+    :param filepath: path of the bz2 file, single or multiple (concatenated) streams
+    :param num_threads: number of threads decompressing blocks
+    :param chunk_size: bytes of compressed data read at a time
+
+    Blocks inside a bz2 stream start with a 48-bit magic at any bit offset. Each block is cut out,
+    wrapped into a standalone stream and decompressed by a thread pool, as lbzip2 does.
+    A magic number that shows up by chance inside compressed data yields a block that fails to decompress,
+    it is then joined with its following segments and retried. The bits after an end-of-stream magic are kept
+    as a gap segment until the next block magic, so that a false end-of-stream magic can be joined back too.
+    A truncated file raises EOFError after all complete blocks are read, as bz2.BZ2File does.
+    """
+
+    def __init__(self, filepath, num_threads=4, chunk_size=16 * 1024 * 1024):
+        self.filepath = filepath
+        self.num_threads = num_threads
+        self.chunk_size = chunk_size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __iter__(self):
+        return self._read_lines()
+
+    def close(self):
+        pass
+
+    def _read_blocks(self):
+        """Yield (bits, number of bits, is_block) of the segments between magics in file order.
+        A block segment starts at a block magic. A gap segment starts at an end-of-stream magic and holds the stream footer
+        and the header of the next stream, or the rest of a block if the magic showed up by chance."""
+        buf = b''
+        buf_offset = 0
+        scan_from = 0
+        last_magic = -1
+        segment_start = None
+        is_block_segment = False
+        with open(self.filepath, 'rb') as fin:
+            while True:
+                chunk = fin.read(self.chunk_size)
+                buf += chunk
+                magics = _find_magics(buf, max(scan_from - buf_offset - 7, 0))
+                for bit_pos, is_block in magics:
+                    bit_pos += buf_offset * 8
+                    # magics within the overlap of two scans are found twice
+                    if bit_pos <= last_magic:
+                        continue
+                    last_magic = bit_pos
+                    if segment_start is not None:
+                        yield self._cut_bits(buf, buf_offset, segment_start, bit_pos) + (is_block_segment,)
+                    segment_start = bit_pos
+                    is_block_segment = is_block
+                scan_from = buf_offset + len(buf)
+
+                if not chunk:
+                    # a last block segment has no end-of-stream after it, the file is truncated
+                    if segment_start is not None:
+                        yield self._cut_bits(buf, buf_offset, segment_start, scan_from * 8) + (is_block_segment,)
+                    return
+
+                keep_from = segment_start // 8 if segment_start is not None else scan_from - 7
+                keep_from = max(keep_from, buf_offset)
+                buf = buf[keep_from - buf_offset:]
+                buf_offset = keep_from
+
+    @staticmethod
+    def _cut_bits(buf, buf_offset, start_bit, end_bit):
+        start_byte = start_bit // 8
+        end_byte = (end_bit + 7) // 8
+        bits = int.from_bytes(buf[start_byte - buf_offset: end_byte - buf_offset], 'big')
+        bits >>= end_byte * 8 - end_bit
+        num_bits = end_bit - start_bit
+        return bits & ((1 << num_bits) - 1), num_bits
+
+    def _next_data(self, pending):
+        block_bits, num_bits, future = pending.popleft()
+        if future is None:
+            # the gap after a decompressed block is the end of its stream
+            return b''
+        try:
+            return future.result()
+        except (OSError, ValueError):
+            pass
+        # a false magic split the block, join it with the following segments until it decompresses
+        while pending:
+            next_bits, next_num_bits, _ = pending.popleft()
+            block_bits = (block_bits << next_num_bits) | next_bits
+            num_bits += next_num_bits
+            try:
+                return _decompress_block(block_bits, num_bits)
+            except (OSError, ValueError):
+                continue
+        raise EOFError('Compressed file ended before the end-of-stream marker was reached')
+
+    def _read_lines(self):
+        remainder = b''
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.num_threads) as executor:
+            for block_bits, num_bits, is_block in self._read_blocks():
+                # gaps are only decompressed when joined to the block before them
+                pending.append((block_bits, num_bits, executor.submit(_decompress_block, block_bits, num_bits) if is_block else None))
+                # keep one block behind the head, in case the head needs to be joined
+                while len(pending) > 2 * self.num_threads:
+                    lines = io.BytesIO(remainder + self._next_data(pending)).readlines()
+                    remainder = lines.pop() if lines and not lines[-1].endswith(b'\n') else b''
+                    yield from lines
+            while pending:
+                lines = io.BytesIO(remainder + self._next_data(pending)).readlines()
+                remainder = lines.pop() if lines and not lines[-1].endswith(b'\n') else b''
+                yield from lines
+        if remainder:
+            yield remainder
+
+
+class ParallelBZ2Writer(object):
+    """ Block-parallel bz2 writer, behaves like pbzip2.
+
+    :param filepath: path of the output bz2 file
+    :param mode: 'wt' or 'wb' to truncate, 'at' or 'ab' to append
+    :param num_threads: number of threads compressing blocks
+    :param block_size: bytes of uncompressed data in each independently compressed stream
+
+    Data is cut into blocks, each compressed into its own bz2 stream by a thread pool and written in order.
+    The concatenated streams are readable by bz2.BZ2File and any bzip2 tool.
+    """
+
+    def __init__(self, filepath, mode='wt', num_threads=4, block_size=900 * 1000, compresslevel=9):
+        self.text_mode = 't' in mode
+        self.output = open(filepath, mode.replace('t', '').replace('b', '') + 'b')
+        self.num_threads = num_threads
+        self.block_size = block_size
+        self.compresslevel = compresslevel
+
+        self.executor = ThreadPoolExecutor(max_workers=num_threads)
+        self.pending = deque()
+        self.buffer = []
+        self.buffer_size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def write(self, data):
+        if self.text_mode:
+            data = data.encode('utf-8')
+        self.buffer.append(data)
+        self.buffer_size += len(data)
+        if self.buffer_size >= self.block_size:
+            self._submit_buffer()
+        return len(data)
+
+    def _submit_buffer(self):
+        block = b''.join(self.buffer)
+        self.buffer = []
+        self.buffer_size = 0
+        self.pending.append(self.executor.submit(bz2.compress, block, self.compresslevel))
+        while len(self.pending) > 2 * self.num_threads:
+            self.output.write(self.pending.popleft().result())
+
+    def flush(self):
+        if self.buffer_size > 0:
+            self._submit_buffer()
+        while self.pending:
+            self.output.write(self.pending.popleft().result())
+        self.output.flush()
+
+    def close(self):
+        if self.output.closed:
+            return
+        self.flush()
+        self.executor.shutdown()
+        self.output.close()
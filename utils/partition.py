@@ -0,0 +1,53 @@
+def first_fit_decreasing(items, capacity, bin_volume=None):
+    """Pack items into as few bins as the first fit decreasing heuristic finds, each bin holding at most capacity.
+    :param items: dict of {name: volume}, an item larger than capacity gets a bin of its own
+    :param bin_volume: function returning the volume of a list of names, for items that overlap, None sums their volumes
+    :return: list of (total volume, list of names) per bin, in the order the bins were opened"""
+    bins = []
+    for name, volume in sorted(items.items(), key=lambda x: (-x[1], str(x[0]))):
+        for i, (bin_volume_so_far, bin_names) in enumerate(bins):
+            new_volume = bin_volume_so_far + volume if bin_volume is None else bin_volume(bin_names + [name])
+            if new_volume <= capacity:
+                bin_names.append(name)
+                bins[i] = (new_volume, bin_names)
+                break
+        else:
+            bins.append((volume, [name]))
+    return bins
+
+
+def predicate_volume(volumes, keywords, languages):
+    """Return the number of distinct tweets a predicate tracking keywords x languages receives.
+    :param volumes: dict of {(frozenset of matched keywords, language): volume}, each tweet counted once under all keywords it matches"""
+    keywords = set(keywords)
+    languages = set(languages)
+    return sum(volume for (matched, lang), volume in volumes.items() if lang in languages and not matched.isdisjoint(keywords))
+
+
+def plan_partition(volumes, keywords, languages, capacity):
+    """Split keywords x languages into subcrawler predicates whose volumes stay under capacity, with as few predicates as packing finds.
+    :param volumes: dict of {(frozenset of matched keywords, language): volume}, see predicate_volume()
+    :param keywords: all tracked keywords
+    :param languages: all tracked languages
+    :return: list of (keywords, languages, volume) per predicate
+
+    A predicate of the filter endpoint tracks every pair of its keywords and its languages, so predicates are rectangles.
+    Languages whose keywords fit in one predicate are packed together with all keywords,
+    the keywords of the other languages are packed into predicates of that single language.
+    A tweet matching several keywords counts once in a predicate, so keyword volumes are not summed but recounted per bin.
+    A keyword of one language larger than capacity still gets a predicate, which will be rate limited.
+    """
+    language_volumes = {lang: predicate_volume(volumes, keywords, [lang]) for lang in languages}
+    plan = []
+    small_languages = {lang: volume for lang, volume in language_volumes.items() if volume <= capacity}
+    for volume, bin_languages in first_fit_decreasing(small_languages, capacity):
+        plan.append((list(keywords), sorted(bin_languages, key=languages.index), volume))
+    for lang in languages:
+        if language_volumes[lang] <= capacity:
+            continue
+        lang_volumes = {cell: volume for cell, volume in volumes.items() if cell[1] == lang}
+        keyword_volumes = {keyword: predicate_volume(lang_volumes, [keyword], [lang]) for keyword in keywords}
+        for volume, bin_keywords in first_fit_decreasing(keyword_volumes, capacity,
+                                                         bin_volume=lambda names: predicate_volume(lang_volumes, names, [lang])):
+            plan.append((sorted(bin_keywords, key=keywords.index), [lang], volume))
+    return plan
@@ -0,0 +1,14 @@
+from tweepy import Stream
+
+
+class PolicyStream(Stream):
+    """ A tweepy Stream whose filter() returns when the server closes the connection, instead of reconnecting at once,
+    so that the caller waits as its ReconnectPolicy says.
+
+    tweepy 3.10 reconnects by itself after on_closed() without telling the listener.
+    A listener ends the stream on disconnect messages, HTTP errors and timeouts by returning False,
+    see StdOutListener in crawlers/multi_process_crawlers.py.
+    """
+
+    def on_closed(self, resp):
+        self.running = False
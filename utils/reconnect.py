@@ -0,0 +1,87 @@
+import time, random
+
+
+class ReconnectPolicy(object):
+    """ Backoff between reconnections of a streaming crawler, following Twitter's guidance on reconnecting.
+
+    :param network_step: seconds added to the wait after each network error, TCP/IP errors, timeouts and stalls
+    :param network_cap: maximal wait after network errors
+    :param http_start: first wait after an HTTP error, doubled after each further one
+    :param http_cap: maximal wait after HTTP errors
+    :param rate_limit_start: first wait after an HTTP 420 or 429, doubled after each further one
+    :param rate_limit_cap: maximal wait after HTTP 420 or 429
+    :param jitter: random fraction of the wait added to it, so that crawlers sharing a key do not reconnect together
+    :param stall_timeout: seconds without any bytes after which a connection is stalled,
+                          Twitter sends a keep-alive newline every 30 seconds
+
+    The backoff is reset once a connection stays up for stall_timeout seconds,
+    so that a connection dropped right after it was accepted keeps backing off.
+    """
+
+    def __init__(self, network_step=0.25, network_cap=16, http_start=5, http_cap=320, rate_limit_start=60, rate_limit_cap=960,
+                 jitter=0.1, stall_timeout=90):
+        self.network_step = network_step
+        self.network_cap = network_cap
+        self.http_start = http_start
+        self.http_cap = http_cap
+        self.rate_limit_start = rate_limit_start
+        self.rate_limit_cap = rate_limit_cap
+        self.jitter = jitter
+        self.stall_timeout = stall_timeout
+
+        self.network_wait = 0
+        self.http_wait = 0
+        self.rate_limit_wait = 0
+        self.start_ts = time.time()
+        self.connect_ts = None
+        self.uptime = 0
+        self.num_network_error = 0
+        self.num_http_error = 0
+        self.num_rate_limit = 0
+
+    def on_connect(self):
+        """Record that the endpoint accepted the connection."""
+        self.connect_ts = time.time()
+
+    def on_disconnect(self, status_code=None):
+        """Record a failed or lost connection, return the seconds to wait before reconnecting.
+        :param status_code: HTTP status code of the response rejecting the connection, None for network errors"""
+        now = time.time()
+        if self.connect_ts is not None:
+            self.uptime += now - self.connect_ts
+            if now - self.connect_ts >= self.stall_timeout:
+                self.network_wait = 0
+                self.http_wait = 0
+                self.rate_limit_wait = 0
+            self.connect_ts = None
+
+        if status_code in (420, 429):
+            self.num_rate_limit += 1
+            self.rate_limit_wait = self.rate_limit_start if self.rate_limit_wait == 0 else min(self.rate_limit_wait * 2, self.rate_limit_cap)
+            wait = self.rate_limit_wait
+        elif status_code is not None:
+            self.num_http_error += 1
+            self.http_wait = self.http_start if self.http_wait == 0 else min(self.http_wait * 2, self.http_cap)
+            wait = self.http_wait
+        else:
+            self.num_network_error += 1
+            self.network_wait = min(self.network_wait + self.network_step, self.network_cap)
+            wait = self.network_wait
+        return wait * (1 + random.uniform(0, self.jitter))
+
+    def num_disconnect(self):
+        """Return the number of disconnects so far."""
+        return self.num_network_error + self.num_http_error + self.num_rate_limit
+
+    def uptime_ratio(self):
+        """Return the fraction of time since the crawler started that it has been connected."""
+        now = time.time()
+        uptime = self.uptime
+        if self.connect_ts is not None:
+            uptime += now - self.connect_ts
+        return uptime / max(now - self.start_ts, 1e-9)
+
+    def summary(self):
+        """Return the uptime and disconnects so far, as a string for log messages."""
+        return 'uptime: {0:.2%} over {1:.1f}h, {2} network errors, {3} HTTP errors, {4} rate limits' \
+            .format(self.uptime_ratio(), (time.time() - self.start_ts) / 3600, self.num_network_error, self.num_http_error, self.num_rate_limit)